@@ -1,23 +1,143 @@
+"""
+app.py
+
+Application factory and process lifecycle.
+    - create_app: build and wire the application. It opens no mongo connection, so it is safe in a process that forks
+      afterwards, e.g. the gunicorn master with preload_app (see gunicorn.conf.py).
+    - prepare_master: once, before any worker is forked: apply MONGO_INDEX_MODE with a short-lived client and warm
+      the schemas so the workers share them.
+    - start_worker: in every serving process: connect to mongo and optionally warm the connection pool before the
+      first request. Processes that weren't started through gunicorn's post_fork run it on their first request.
+"""
+
+from pymodm.connection import _get_db
+
 from src.resources.auth import RegisterResource, LoginResource
-from src.resources.template import TemplateResource
-from src.services.template import TemplateService
+from src.resources.template import TemplateResource, TemplateRenderResource, TemplateMergeResource, \
+    TemplateSearchResource
+from src.services.template import TemplateService, template_cache, renderer
 from src.services.user import UserService
-from src.base.middleware import AuthMiddleware
+from src.base.error_handlers import register_error_handlers
+from src.base.middleware import AuthMiddleware, CompressionMiddleware
+from src.base.indexes import reconcile_indexes
+from src.base.lifecycle import Lifecycle, StartupReport, warm_schemas, warm_collections
+from src.base.metrics import TimingMiddleware, record_endpoint, registry
+from src.base.pool import pool_monitor
+from src.models import User, Template, connect_db
 import settings
-from src import app, api
+from src import make_app
+
+MODELS = [User, Template]
+
+
+def create_app(settings=settings):
+    report = StartupReport("app")
+    with report.step("create_app"):
+        app, api = make_app()
+        lifecycle = app.extensions["lifecycle"] = Lifecycle()
+
+        auth = app.wsgi_app = AuthMiddleware(app.wsgi_app, settings=settings,
+                                             ignored_endpoints=["/register", "/login"])
+        if settings.COMPRESSION_ENABLED:
+            app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=settings.COMPRESSION_MIN_SIZE,
+                                                 level=settings.COMPRESSION_LEVEL,
+                                                 zstd_level=settings.COMPRESSION_ZSTD_LEVEL,
+                                                 max_request_bytes=settings.COMPRESSION_MAX_REQUEST_BYTES)
+        if settings.METRICS_ENABLED:
+            registry.register_stats("app_token_cache", auth.token_cache.stats)
+            registry.register_stats("app_mongo_pool", pool_monitor.stats)
+            app.wsgi_app = TimingMiddleware(app.wsgi_app, metrics_path=settings.METRICS_PATH)
+            app.before_request(record_endpoint)
+
+        template = TemplateResource.initiate(serializers=TemplateResource.serializers, service_klass=TemplateService)
+        render = TemplateRenderResource.initiate(serializers=TemplateRenderResource.serializers,
+                                                 service_klass=TemplateService)
+        merge = TemplateMergeResource.initiate(serializers=TemplateMergeResource.serializers,
+                                               service_klass=TemplateService)
+        search = TemplateSearchResource.initiate(serializers=TemplateSearchResource.serializers,
+                                                 service_klass=TemplateService)
+        register = RegisterResource.initiate(serializers=RegisterResource.serializers, service_klass=UserService)
+        login = LoginResource.initiate(serializers=LoginResource.serializers, service_klass=UserService)
+
+        api.add_resource(register, '/register')
+        api.add_resource(login, '/login')
+        api.add_resource(template, '/template', '/template/<string:obj_id>')
+        api.add_resource(search, '/template/search')
+        api.add_resource(render, '/template/<string:obj_id>/render')
+        api.add_resource(merge, '/template/<string:obj_id>/merge')
+        register_error_handlers(app)
+
+        if settings.METRICS_ENABLED:
+            if template_cache is not None:
+                registry.register_stats("app_template_object_cache", template_cache.stats)
+            if template.list_cache is not None:
+                registry.register_stats("app_template_list_cache", template.list_cache.stats)
+            registry.register_stats("app_template_render_cache", renderer.stats)
+
+        @app.before_request
+        def ensure_worker_started():
+            # a single attribute check once started, only hit when no post_fork hook started this process
+            if not lifecycle.worker_started:
+                start_worker(app, settings=settings)
+
+    lifecycle.reports.append(report)
+    return app
+
+
+def apply_index_mode(settings=settings):
+    if settings.MONGO_INDEX_MODE in ("create", "reconcile"):
+        reconcile_indexes(MODELS, drop_undeclared=settings.MONGO_INDEX_MODE == "reconcile")
+
 
-app.wsgi_app = AuthMiddleware(app.wsgi_app, settings=settings, ignored_endpoints=["/register", "/login"])
+def prepare_master(app, settings=settings):
+    """
+    Run once in the process the workers are forked from. The mongo client it opens for the indexes is closed again
+    before returning, the workers open their own.
+    """
+    lifecycle = app.extensions["lifecycle"]
+    report = StartupReport("master")
+    if settings.MONGO_INDEX_MODE in ("create", "reconcile"):
+        with report.step("indexes"):
+            connect_db()
+            try:
+                apply_index_mode(settings)
+            finally:
+                _get_db().client.close()
+    lifecycle.indexes_applied = True
+    if settings.WARM_SCHEMAS:
+        with report.step("schemas", required=False):
+            warm_schemas(app.extensions["api"])
+    lifecycle.reports.append(report)
+    print(report)
+    return report
 
 
-template = TemplateResource.initiate(serializers=TemplateResource.serializers, service_klass=TemplateService)
-register = RegisterResource.initiate(serializers=RegisterResource.serializers, service_klass=UserService)
-login = LoginResource.initiate(serializers=LoginResource.serializers, service_klass=UserService)
+def start_worker(app, settings=settings):
+    """ connect this process to mongo and warm it up, once. """
+    lifecycle = app.extensions["lifecycle"]
+    with lifecycle.lock:
+        if lifecycle.worker_started:
+            return None
+        report = StartupReport("worker")
+        with report.step("connect"):
+            connect_db()
+        if not lifecycle.indexes_applied and settings.MONGO_INDEX_MODE in ("create", "reconcile"):
+            with report.step("indexes"):
+                apply_index_mode(settings)
+        lifecycle.indexes_applied = True
+        if settings.WARM_WORKERS:
+            with report.step("collections", required=False):
+                warm_collections(MODELS, timeout=settings.WARM_TIMEOUT)
+        lifecycle.worker_started = True
+        lifecycle.reports.append(report)
+    print(report)
+    return report
 
 
-api.add_resource(register, '/register')
-api.add_resource(login, '/login')
-api.add_resource(template, '/template', '/template/<string:obj_id>')
+app = create_app(settings)
+api = app.extensions["api"]
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    start_worker(app)
+    app.run(debug=True)
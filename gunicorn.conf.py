@@ -0,0 +1,27 @@
+"""
+gunicorn.conf.py
+
+Loaded by gunicorn from the working directory. The application is imported and wired once in the master and the
+workers are forked from it, sharing that memory copy-on-write; each worker then opens its own mongo client.
+"""
+
+import gc
+
+import settings
+
+preload_app = True
+threads = settings.WORKER_THREADS
+
+
+def when_ready(server):
+    from app import app, prepare_master
+
+    prepare_master(app)
+    # keep the collector from touching (and so copying) the objects every worker inherits
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import app, start_worker
+
+    start_worker(app)
@@ -32,3 +32,96 @@ ENV = os.getenv("ENV")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM")
 JWT_EXPIRES_IN_HOURS = int(os.getenv("JWT_EXPIRES_IN_HOURS", "200"))
+# verified token claims kept per worker by AuthMiddleware, 0 disables the cache
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024"))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+
+# bcrypt work factor, stored hashes with a different cost are rehashed on the next successful login
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "12"))
+# inline, thread or process
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# hashing jobs allowed to wait per worker process before requests are answered with 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "8"))
+
+# How declared model indexes are applied at startup:
+#   lazy      - pymodm creates them on first use of each collection
+#   create    - create missing indexes at startup, leave the rest alone
+#   reconcile - create missing indexes and drop undeclared or conflicting ones at startup
+MONGO_INDEX_MODE = os.getenv("MONGO_INDEX_MODE", "lazy")
+
+# read-through cache of objects by id for the services that opt in, per worker. Writes only invalidate the worker that
+# made them, other workers keep serving the old object (and its old ETag, failing If-Match writes with 412) for up to
+# the ttl. Off by default: only enable it with a single worker, or with cross-worker invalidation. 0 disables the cache.
+OBJECT_CACHE_SIZE = int(os.getenv("OBJECT_CACHE_SIZE", "10000"))
+OBJECT_CACHE_TTL = int(os.getenv("OBJECT_CACHE_TTL", "0"))
+
+# serialized list responses per user, per worker. Writes only bump the user's generation in the worker that made them,
+# other workers keep serving (and answering 304 against) the old list for up to the ttl. Off by default: only enable
+# it with a single worker, or with ListCache given a generations store shared by every worker. 0 disables the cache.
+# A worker holds at most LIST_CACHE_SIZE * LIST_CACHE_MAX_ENTRY_BYTES of bodies.
+LIST_CACHE_SIZE = int(os.getenv("LIST_CACHE_SIZE", "200"))
+LIST_CACHE_TTL = int(os.getenv("LIST_CACHE_TTL", "0"))
+LIST_CACHE_MAX_ENTRY_BYTES = int(os.getenv("LIST_CACHE_MAX_ENTRY_BYTES", str(64 * 1024)))
+
+# compiled subject/body templates kept per worker for POST /template/<id>/render, keyed by (id, last_updated) so an
+# edit is never rendered from a stale compilation. RENDER_AUTOESCAPE html-escapes the context values.
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "256"))
+RENDER_CACHE_TTL = int(os.getenv("RENDER_CACHE_TTL", "3600"))
+RENDER_AUTOESCAPE = os.getenv("RENDER_AUTOESCAPE", "false").lower() == "true"
+# what a single render of a stored template may cost (src/base/rendering.py): characters of a rendered field (and of
+# any value built while rendering), loop iterations, and seconds
+RENDER_MAX_OUTPUT = int(os.getenv("RENDER_MAX_OUTPUT", str(512 * 1024)))
+RENDER_MAX_ITERATIONS = int(os.getenv("RENDER_MAX_ITERATIONS", "100000"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "1"))
+RENDER_LIMITS = {"max_output": RENDER_MAX_OUTPUT, "max_iterations": RENDER_MAX_ITERATIONS, "timeout": RENDER_TIMEOUT}
+
+# batch rendering (POST /template/<id>/merge): an executor per worker, see src/base/merge.py. Every gunicorn worker
+# starts MERGE_WORKERS processes of its own, size gunicorn workers * MERGE_WORKERS to the cores. MERGE_MAX_IN_FLIGHT 0
+# is twice MERGE_WORKERS; together with the batch size it bounds the rows in memory. A batch not rendered within
+# MERGE_CHUNK_TIMEOUT seconds is answered with error rows and its process killed.
+MERGE_EXECUTOR = os.getenv("MERGE_EXECUTOR", "process")
+MERGE_WORKERS = int(os.getenv("MERGE_WORKERS", "1"))
+MERGE_BATCH_SIZE = int(os.getenv("MERGE_BATCH_SIZE", "500"))
+MERGE_MAX_BATCH_SIZE = int(os.getenv("MERGE_MAX_BATCH_SIZE", "5000"))
+MERGE_MAX_IN_FLIGHT = int(os.getenv("MERGE_MAX_IN_FLIGHT", "0"))
+MERGE_CHUNK_TIMEOUT = float(os.getenv("MERGE_CHUNK_TIMEOUT", "60"))
+
+# per-request timing: Server-Timing headers and latency histograms served in the Prometheus text format at
+# METRICS_PATH, which bypasses authentication, so keep it off the public network.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+# mongo commands slower than this are logged with their filter shape, 0 disables the slow log. With
+# MONGO_SLOW_QUERY_EXPLAIN the log line also carries a plan summary, at the cost of an explain per slow command.
+MONGO_SLOW_QUERY_MS = int(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+MONGO_SLOW_QUERY_EXPLAIN = os.getenv("MONGO_SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+# warn when a request issues more mongo commands than this, 0 disables the check
+MONGO_QUERY_BUDGET = int(os.getenv("MONGO_QUERY_BUDGET", "0"))
+
+# startup warm-up: build the resource schemas in the process the workers are forked from, and resolve the collections
+# and open a mongo connection in each worker before it serves its first request
+WARM_SCHEMAS = os.getenv("WARM_SCHEMAS", "true").lower() == "true"
+WARM_WORKERS = os.getenv("WARM_WORKERS", "true").lower() == "true"
+WARM_TIMEOUT = float(os.getenv("WARM_TIMEOUT", "5"))
+
+# threads serving requests in each worker process, gunicorn.conf.py runs gunicorn with this many --threads
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "1"))
+# mongo connection pool of each worker: one connection per request thread plus a little headroom (startup warm-up,
+# slow query explains). Operations wait at most MONGO_WAIT_QUEUE_TIMEOUT_MS for a connection and then fail, so an
+# overloaded mongod sees a bounded number of connections instead of a storm.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", str(WORKER_THREADS + 2)))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "1000"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# server side limit of a single read or findAndModify (maxTimeMS), 0 disables it
+MONGO_MAX_TIME_MS = int(os.getenv("MONGO_MAX_TIME_MS", "5000"))
+
+# gzip (or zstd, when the zstandard package is installed) responses from COMPRESSION_MIN_SIZE bytes, and gzip request
+# bodies inflated up to COMPRESSION_MAX_REQUEST_BYTES
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+COMPRESSION_MAX_REQUEST_BYTES = int(os.getenv("COMPRESSION_MAX_REQUEST_BYTES", str(10 * 1024 * 1024)))
@@ -1,6 +1,15 @@
 from flask_restful import Api
 from flask import Flask
 
-app = Flask(__name__)
+from src.base.encoding import OrjsonProvider, output_json
 
-api = Api(app)
+
+def make_app():
+    """ a bare flask app and its flask-restful Api, wired up by create_app in app.py """
+
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    api = Api(app)
+    api.representations["application/json"] = output_json
+    app.extensions["api"] = api
+    return app, api
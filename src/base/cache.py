@@ -0,0 +1,195 @@
+"""
+cache.py
+
+In-process caches used by the middleware, services and resources.
+    - LRUCache: bounded LRU where every entry also expires after a ttl, safe to share between threads
+    - ObjectCache: read-through cache of raw mongo documents keyed by collection and _id, with an in-process LRUCache
+      tier in front of an optional shared tier
+    - ListCache: serialized list responses per user, invalidated by bumping the user's GenerationCounter
+
+Each worker process has its own in-process tier and invalidation only reaches the worker that made the write (and the
+shared tier), so keep the ttl short enough that another worker serving a stale object for that long is acceptable.
+"""
+
+from collections import OrderedDict
+import itertools
+from threading import Lock
+import time
+
+
+class LRUCache(object):
+    """ Bounded LRU cache whose entries expire after ttl seconds """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """ the cached value for key, None if absent or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def set(self, key, value, expires_at=None):
+        """ cache value under key until the ttl runs out, or until expires_at if that is sooner """
+        if self.maxsize <= 0:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._entries[key] = (value, deadline)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize,
+                    "hit_rate": float(self.hits) / total if total else 0.0}
+
+
+class ObjectCache(object):
+    """
+    Read-through cache of raw documents for a service (see ServiceFactory.create_service).
+
+    shared is an optional second tier common to every worker, e.g. a thin redis adapter. It only needs
+    get(key) -> document or None, set(key, document, ttl) and delete(key), and takes care of encoding the documents
+    (ObjectId and datetime values included) itself.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30, shared=None, shared_ttl=None):
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.shared = shared
+        self.shared_ttl = shared_ttl or ttl
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @staticmethod
+    def key(model_class, obj_id):
+        return "{}:{}".format(model_class._mongometa.collection_name, obj_id)
+
+    def get(self, model_class, obj_id):
+        """ a copy of the cached document, None on a miss in every tier """
+        key = self.key(model_class, obj_id)
+        doc = self.local.get(key)
+        if doc is None and self.shared is not None:
+            doc = self.shared.get(key)
+            if doc is None:
+                self.shared_misses += 1
+            else:
+                self.shared_hits += 1
+                self.local.set(key, doc)
+        # callers rename and pop keys, never hand out the cached dict itself
+        return dict(doc) if doc is not None else None
+
+    def set(self, model_class, doc):
+        key = self.key(model_class, doc["_id"])
+        doc = dict(doc)
+        self.local.set(key, doc)
+        if self.shared is not None:
+            self.shared.set(key, doc, self.shared_ttl)
+
+    def invalidate(self, model_class, *obj_ids):
+        for obj_id in obj_ids:
+            key = self.key(model_class, obj_id)
+            self.local.delete(key)
+            if self.shared is not None:
+                self.shared.delete(key)
+
+    def stats(self):
+        stats = self.local.stats()
+        if self.shared is not None:
+            stats.update(shared_hits=self.shared_hits, shared_misses=self.shared_misses)
+        return stats
+
+
+class GenerationCounter(object):
+    """
+    Per-key generation numbers. Cache keys embed the current generation, so a bump makes every entry built from the
+    old one unreachable at once, with no scan. Numbers come from one process-wide sequence, so a key that is evicted
+    and seen again never gets back a generation an old entry was stored under.
+
+    A shared implementation (e.g. redis INCR) only needs the same get(key)/bump(key) interface.
+    """
+
+    def __init__(self, maxsize=100000):
+        self._generations = LRUCache(maxsize=maxsize, ttl=float("inf"))
+        self._sequence = itertools.count(1)
+
+    def get(self, key):
+        generation = self._generations.get(key)
+        if generation is None:
+            generation = next(self._sequence)
+            self._generations.set(key, generation)
+        return generation
+
+    def bump(self, key):
+        self._generations.set(key, next(self._sequence))
+
+
+class ListCache(object):
+    """
+    Serialized list responses keyed by (resource, user, query params, generation). Writes bump the (resource, user)
+    generation. Bodies over max_entry_bytes are never cached, so memory stays under maxsize * max_entry_bytes.
+    """
+
+    def __init__(self, maxsize=1000, ttl=60, max_entry_bytes=256 * 1024, generations=None):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.max_entry_bytes = max_entry_bytes
+        self.generations = generations or GenerationCounter()
+
+    def key(self, resource, user_id, params):
+        return resource, user_id, params, self.generations.get((resource, user_id))
+
+    def get(self, key):
+        """ (body, etag, last_modified) or None """
+        return self.entries.get(key)
+
+    def set(self, key, body, etag=None, last_modified=None):
+        if len(body) <= self.max_entry_bytes:
+            self.entries.set(key, (body, etag, last_modified))
+
+    def capture(self, key, chunks, etag=None, last_modified=None):
+        """ pass a streamed body through, caching it once it has been sent whole (if it fits) """
+        parts, size = [], 0
+        for chunk in chunks:
+            if parts is not None:
+                part = chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+                size += len(part)
+                if size <= self.max_entry_bytes:
+                    parts.append(part)
+                else:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            self.set(key, b"".join(parts), etag, last_modified)
+
+    def bump(self, resource, user_id):
+        self.generations.bump((resource, user_id))
+
+    def stats(self):
+        return self.entries.stats()
@@ -0,0 +1,75 @@
+"""
+encoding.py
+
+JSON encoding and decoding backed by orjson, used for the Api's application/json representation, flask's request
+parsing (app.json) and the bodies the resources build themselves. orjson handles datetime and date natively,
+default() covers the types of ours it doesn't know: ObjectId, bytes and pymodm models.
+
+to_primitive converts the same types straight into JSON-compatible python values, for code that needs the data
+rather than the text.
+"""
+
+from datetime import date, datetime
+
+import orjson
+from bson.objectid import ObjectId
+from flask import make_response
+from flask.json.provider import JSONProvider
+from pymodm import MongoModel, EmbeddedMongoModel
+
+OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def default(obj):
+    """ orjson fallback for the types it doesn't serialize itself """
+
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8")
+    if isinstance(obj, (MongoModel, EmbeddedMongoModel)):
+        return obj.to_son().to_dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def dumps(obj):
+    """ :return: the JSON document as bytes """
+    return orjson.dumps(obj, default=default, option=OPTIONS)
+
+
+loads = orjson.loads
+
+
+def to_primitive(obj):
+    """ obj with every value converted to what it would be after a dumps/loads round trip, without the text """
+
+    if isinstance(obj, dict):
+        return dict((key if isinstance(key, str) else str(key), to_primitive(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [to_primitive(item) for item in obj]
+    if obj is None or isinstance(obj, (str, bool, int, float)):
+        return obj
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return to_primitive(default(obj))
+
+
+def output_json(data, code, headers=None):
+    """ flask-restful representation for application/json """
+
+    resp = make_response(dumps(data), code)
+    resp.headers.extend(headers or {})
+    resp.mimetype = "application/json"
+    return resp
+
+
+class OrjsonProvider(JSONProvider):
+    """ flask JSON provider, so request.json and jsonify go through orjson too """
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return loads(s)
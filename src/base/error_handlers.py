@@ -1,26 +1,24 @@
-from src import app
 from flask import jsonify
 
 
-@app.errorhandler(404)
-def custom404(data):
-    response = jsonify(data)
-    response.status_code = 404
-    response.status = "error.NotFound"
+def error_response(error, status):
+    """ the JSON body of an HTTP error: what abort() was given, {"message": {"desc": ...}} otherwise """
+    response = jsonify(getattr(error, "data", None) or {"message": {"desc": error.description}})
+    response.status = status
     return response
 
 
-@app.errorhandler(401)
-def custom401(data):
-    response = jsonify(data)
-    response.status_code = 401
-    response.status = "error.Unauthorized"
-    return response
+def register_error_handlers(app):
+    """ answer the errors raised outside of the flask-restful resources (e.g. unknown URLs) with JSON too """
 
+    @app.errorhandler(404)
+    def custom404(error):
+        return error_response(error, "404 error.NotFound")
 
-@app.errorhandler(409)
-def custom409(data):
-    response = jsonify(data)
-    response.status_code = 409
-    response.status = "error.Validation Failed"
-    return response
+    @app.errorhandler(401)
+    def custom401(error):
+        return error_response(error, "401 error.Unauthorized")
+
+    @app.errorhandler(409)
+    def custom409(error):
+        return error_response(error, "409 error.Validation Failed")
@@ -0,0 +1,92 @@
+"""
+executors.py
+
+The executor behind the work the worker processes hand off the request thread (password hashing, mail merge).
+Executor pools don't survive a fork, and a process pool is broken for good once one of its processes dies (an OOM
+kill, a crash), so WorkerPool hands out the current process's pool, building it on first use in every process and
+replacing it once it is broken.
+
+Executors:
+    - thread: a ThreadPoolExecutor
+    - process: a ProcessPoolExecutor. Its processes are started by a forkserver rather than forked from the worker,
+      which by then runs threads (pymongo's monitors, the request threads, thread pools) whose locks a fork could
+      copy while held. Like with spawn, the processes import the __main__ module, so a script using one needs an
+      if __name__ == "__main__" guard
+"""
+
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+
+
+class WorkerPool(object):
+    """ A per-process executor that is rebuilt after a fork or once broken """
+
+    def __init__(self, executor="thread", workers=2):
+        self.executor = executor
+        self.workers = workers
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """ the executor of the current process """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                if self.executor == "process":
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("forkserver"))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def discard(self, pool, terminate=False):
+        """
+        drop a broken pool, the next get() builds a new one. A pool that was already replaced is left alone.
+
+        :param terminate: also kill the processes of a process pool, e.g. one stuck on a task. Threads can't be killed,
+            a thread pool's are left to finish
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            elif not terminate:
+                return
+        if terminate and isinstance(pool, ProcessPoolExecutor):
+            # there's no public way to stop a running task, the pool breaks and fails its other futures
+            for process in list((pool._processes or {}).values()):
+                process.terminate()
+        pool.shutdown(wait=False)
+
+    def submit(self, fn, *args):
+        """
+        submit fn(*args), to a new pool when the current one turns out broken.
+
+        :return: (the pool it was submitted to, the future), the pool is what to discard() when the future fails with
+            BrokenExecutor
+        """
+        pool = self.get()
+        try:
+            return pool, pool.submit(fn, *args)
+        except BrokenExecutor:
+            self.discard(pool)
+            pool = self.get()
+            return pool, pool.submit(fn, *args)
+
+    def run(self, fn, *args):
+        """ fn(*args) on the pool. A call whose pool broke under it is retried once, on a new pool. """
+        pool, future = self.submit(fn, *args)
+        try:
+            return future.result()
+        except BrokenExecutor:
+            self.discard(pool)
+            return self.submit(fn, *args)[1].result()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            if pool is None or self._pid != os.getpid():
+                return
+        pool.shutdown()
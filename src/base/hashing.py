@@ -0,0 +1,93 @@
+"""
+hashing.py
+
+Password hashing off the request thread. bcrypt is slow on purpose, so every hash/verify is submitted to a small
+executor shared by the worker process instead of running inline. The number of jobs waiting on the executor is capped:
+once it is full, callers get HasherBusy straight away (and the resources answer 503) instead of piling up behind a
+login storm.
+
+Executors:
+    - inline: run on the calling thread, no pool
+    - thread: a thread pool, bcrypt releases the GIL while hashing
+    - process: a process pool, for when hashing has to be isolated from the worker entirely
+The pools are WorkerPools (see executors.py), rebuilt after a fork or after one of their processes died.
+"""
+
+import threading
+
+import bcrypt
+
+from src.base.executors import WorkerPool
+from src.base.metrics import timed
+
+
+class HasherBusy(Exception):
+    """ Raised when the hashing queue is full """
+
+
+def _encode(value):
+    return value if isinstance(value, bytes) else value.encode("utf-8")
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode()
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher(object):
+    """ bcrypt hashing and verification through a bounded, per-process executor """
+
+    def __init__(self, rounds=12, executor="thread", workers=2, max_pending=8):
+        self.rounds = rounds
+        self.executor = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool = WorkerPool(executor=executor, workers=workers)
+        self._lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        with timed("hashing"):
+            return self._submit(fn, *args)
+
+    def _submit(self, fn, *args):
+        if self.executor == "inline" or self.workers <= 0:
+            return fn(*args)
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise HasherBusy("{} password hashing jobs already pending".format(self.pending))
+            self.pending += 1
+        try:
+            return self._pool.run(fn, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def hash(self, password):
+        """
+        Hash a clear text password with the configured work factor
+
+        :param password: str or bytes
+        :return: the bcrypt hash as a str
+        """
+        return self._run(_hashpw, _encode(password), self.rounds)
+
+    def verify(self, password, hashed):
+        """
+        Check a clear text password against a stored bcrypt hash
+
+        :return: bool
+        """
+        return self._run(_checkpw, _encode(password), _encode(hashed))
+
+    def needs_rehash(self, hashed):
+        """ True when the stored hash wasn't produced with the configured work factor """
+
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
@@ -0,0 +1,348 @@
+"""
+indexes.py
+
+Index tooling for the pymodm models. pymodm only ever creates the indexes declared on a model's Meta (lazily, on first
+collection access) and never removes stale ones, and nothing tells us whether the queries our resources issue can
+actually use them. This module covers both sides:
+    - reconcile_indexes: create the declared indexes and drop the undeclared or conflicting ones at startup
+    - filter_shape / serving_index: check at request time that a list filter and sort can be answered by a declared
+      index
+    - advise: drive the GET endpoints (plus a few read-only probes) against a local mongod, record every command the
+      resources issue and report collection scans, in-memory sorts and residual filters from their explain() output
+
+Run from the project root:
+    python -m src.base.indexes advise
+    python -m src.base.indexes reconcile [--no-drop]
+"""
+
+import re
+import sys
+from datetime import datetime, timedelta
+
+import jwt
+from bson.objectid import ObjectId
+from pymongo import monitoring
+from pymongo.errors import OperationFailure
+from pymodm import connect
+from pymodm.connection import _get_db
+
+# commands that the explain command accepts
+EXPLAINABLE_COMMANDS = ("find", "count", "aggregate", "distinct", "findAndModify", "update", "delete")
+
+# options that make two indexes on the same keys different indexes
+INDEX_OPTIONS = {"unique": False, "sparse": False, "expireAfterSeconds": None, "partialFilterExpression": None}
+
+# scanned/returned ratio above which an index is reported as a poor fit
+EXAMINED_RATIO = 10
+
+# read-only requests issued on top of the GET routes. Login with an unknown email only runs its validation lookup.
+DEFAULT_PROBES = [("POST", "/login", {"email": "index-advisor@example.com", "password": "index-advisor"})]
+
+
+def _same_index(declared, existing):
+    """ Compare an IndexModel document with an entry from collection.index_information() """
+
+    keys = list(declared["key"].items())
+    if any(direction == "text" for _, direction in keys):
+        text_fields = set(field for field, direction in keys if direction == "text")
+        if text_fields != set(existing.get("weights", {})):
+            return False
+        keys = [(field, direction) for field, direction in keys if direction != "text"]
+        existing_keys = [(field, direction) for field, direction in existing["key"] if field not in ("_fts", "_ftsx")]
+    else:
+        existing_keys = list(existing["key"])
+    if keys != existing_keys:
+        return False
+
+    for option, default in INDEX_OPTIONS.items():
+        if declared.get(option, default) != existing.get(option, default):
+            return False
+    return True
+
+
+def reconcile_indexes(models, drop_undeclared=True):
+    """
+    Make the indexes on each model's collection match the ones declared on its Meta.
+
+    :param models: MongoModel classes to reconcile
+    :param drop_undeclared: drop indexes that aren't declared (or conflict with a declaration). When False, missing
+        indexes are created and everything else is left in place.
+    :return: {collection name: {"created": [...], "dropped": [...], "kept": [...]}}
+    """
+    report = {}
+    for model in models:
+        meta = model._mongometa
+        # we are managing the indexes from here, stop pymodm from creating them behind our back.
+        meta._indexes_created = True
+        collection = meta.collection
+        existing = collection.index_information()
+        declared = dict((index.document["name"], index) for index in meta.indexes)
+        created, dropped, kept = [], [], []
+
+        for name, info in existing.items():
+            if name == "_id_":
+                continue
+            index = declared.get(name)
+            if index is not None and _same_index(index.document, info):
+                kept.append(name)
+                continue
+            if not drop_undeclared:
+                if index is not None:
+                    print("Index {} on {} differs from its declaration, leaving it in place".format(
+                        name, collection.name))
+                    kept.append(name)
+                continue
+            collection.drop_index(name)
+            dropped.append(name)
+
+        for name, index in declared.items():
+            if name in kept:
+                continue
+            try:
+                collection.create_indexes([index])
+                created.append(name)
+            except OperationFailure as e:
+                if drop_undeclared:
+                    raise
+                print("Could not create index {} on {}: {}".format(name, collection.name, e))
+
+        report[collection.name] = {"created": created, "dropped": dropped, "kept": kept}
+    return report
+
+
+def filter_shape(query):
+    """
+    The fields a filter constrains, following $and. $or branches (e.g. the pagination cursor) are left out.
+
+    :return: (equality fields, range fields), both sets
+    """
+    equality, ranges = set(), set()
+    pending = [query or {}]
+    while pending:
+        for key, value in pending.pop().items():
+            if key == "$and":
+                pending.extend(value)
+            elif key.startswith("$"):
+                continue
+            elif isinstance(value, dict) and value and all(operator.startswith("$") for operator in value):
+                (equality if set(value) <= {"$eq", "$in"} else ranges).add(key)
+            else:
+                equality.add(key)
+    return equality, ranges
+
+
+def serving_index(model, equality, ranges, sort):
+    """
+    Find a declared index that answers a query from the index alone: the equality fields form its prefix, the sort
+    keys follow in order (all in the declared directions or all reversed) and every range field is one of its keys.
+
+    :param model: the MongoModel class
+    :param equality: set of fields compared for equality
+    :param ranges: set of fields compared with range operators
+    :param sort: [(field, direction)] as given to order_by
+    :return: the index name, None when the query would need a collection scan, an in-memory sort or a filter after
+        fetching the documents
+    """
+    for index in model._mongometa.indexes:
+        keys = list(index.document["key"].items())
+        if not all(isinstance(direction, int) for _, direction in keys):
+            continue
+        if set(field for field, _ in keys[:len(equality)]) != set(equality):
+            continue
+        head = keys[len(equality):len(equality) + len(sort)]
+        if [field for field, _ in head] != [field for field, _ in sort]:
+            continue
+        if not (all(direction == wanted for (_, direction), (_, wanted) in zip(head, sort))
+                or all(direction == -wanted for (_, direction), (_, wanted) in zip(head, sort))):
+            continue
+        if not set(ranges) <= set(field for field, _ in keys):
+            continue
+        return index.document["name"]
+    return None
+
+
+class QueryRecorder(monitoring.CommandListener):
+    """ Command listener that keeps every explainable command, tagged with the probe that issued it """
+
+    def __init__(self):
+        self.label = None
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            self.commands.append((self.label, event.database_name, dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _shape(value):
+    """ Replace the values of a filter with their type names so it can be printed and grouped """
+
+    if isinstance(value, dict):
+        return dict((key, _shape(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_shape(item) for item in value]
+    return type(value).__name__
+
+
+def _filter_fields(query):
+    """ Field names referenced by a (possibly $and/$or nested) filter """
+
+    fields = set()
+    if isinstance(query, dict):
+        for key, value in query.items():
+            if key.startswith("$"):
+                fields |= _filter_fields(value)
+            else:
+                fields.add(key)
+    elif isinstance(query, (list, tuple)):
+        for item in query:
+            fields |= _filter_fields(item)
+    return fields
+
+
+def _plan_stages(plan):
+    """ Flatten a winning plan tree into a list of stage documents """
+
+    stages = []
+    pending = [plan.get("queryPlan", plan)]
+    while pending:
+        stage = pending.pop(0)
+        stages.append(stage)
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+    return stages
+
+
+def summarize_plan(explain):
+    """
+    Summarize an explain document.
+
+    :return: dict with the stages, the indexes used, the examined/returned counts and a list of issues
+    """
+    planner = explain.get("queryPlanner", {})
+    stages = _plan_stages(planner.get("winningPlan", {}))
+    stats = explain.get("executionStats", {})
+    summary = {
+        "stages": [stage.get("stage") for stage in stages],
+        "indexes": [stage["indexName"] for stage in stages if stage.get("indexName")],
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "issues": [],
+    }
+
+    if "COLLSCAN" in summary["stages"]:
+        summary["issues"].append("collection scan")
+    if "SORT" in summary["stages"]:
+        summary["issues"].append("in-memory sort")
+    for stage in stages:
+        if stage.get("stage") == "FETCH" and stage.get("filter"):
+            residual = _filter_fields(stage["filter"])
+            if residual:
+                summary["issues"].append("filtered after fetch on {}".format(", ".join(sorted(residual))))
+    examined = max(summary["docs_examined"] or 0, summary["keys_examined"] or 0)
+    if examined > max(summary["returned"] or 0, 1) * EXAMINED_RATIO:
+        summary["issues"].append("examined {} to return {}".format(examined, summary["returned"]))
+    return summary
+
+
+def _explainable(command):
+    """ Strip the session/driver fields pymongo adds so the command can be wrapped in explain """
+
+    ignored = ("lsid", "txnNumber", "autocommit", "startTransaction")
+    return dict((key, value) for key, value in command.items() if not key.startswith("$") and key not in ignored)
+
+
+def advise(flask_app, api, settings, probes=None):
+    """
+    Issue a request against every GET route registered on the api (plus the read-only probes), record the queries the
+    resources send to mongo and explain each one.
+
+    :param flask_app: the flask application (with its wsgi middleware installed)
+    :param api: the flask-restful Api the resources were added to
+    :param settings: settings module, used for the mongo uri and to sign a probe token
+    :param probes: extra (method, path, json body) requests to issue, defaults to DEFAULT_PROBES
+    :return: list of findings, one per recorded command
+    """
+    recorder = QueryRecorder()
+    # replaces the default connection so the models pick up the listener
+    connect(settings.MONGO_DB_URI, connect=False, event_listeners=[recorder])
+
+    token = jwt.encode(dict(first_name="index", last_name="advisor", id=str(ObjectId()),
+                            exp=datetime.now() + timedelta(hours=1)),
+                       key=settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
+    headers = {"Authorization": "Bearer {}".format(token)}
+
+    requests = []
+    for resource, urls, kwargs in api.resources:
+        for url in urls:
+            requests.append(("GET", re.sub(r"<[^>]+>", str(ObjectId()), url), None))
+    requests.extend(DEFAULT_PROBES if probes is None else probes)
+
+    client = flask_app.test_client()
+    for method, path, body in requests:
+        recorder.label = "{} {}".format(method, path)
+        client.open(path, method=method, json=body, headers=headers)
+
+    findings = []
+    client = _get_db().client
+    for label, database_name, command in recorder.commands:
+        explain = client[database_name].command("explain", _explainable(command),
+                                                verbosity="executionStats")
+        command_name = next(iter(command))
+        finding = {"request": label, "command": command_name, "collection": command[command_name],
+                   "filter": _shape(command.get("filter", command.get("query", {}))), "sort": command.get("sort")}
+        finding.update(summarize_plan(explain))
+        findings.append(finding)
+    return findings
+
+
+def _models(api):
+    """ The model classes behind the services of the registered resources """
+
+    models = []
+    for resource, urls, kwargs in api.resources:
+        service_klass = getattr(resource, "service_klass", None)
+        model = getattr(service_klass, "model_class", None)
+        if model is not None and model not in models:
+            models.append(model)
+    return models
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    import settings
+    from app import app, api
+    from src.models import connect_db
+
+    connect_db()
+
+    if argv[:1] == ["reconcile"]:
+        report = reconcile_indexes(_models(api), drop_undeclared="--no-drop" not in argv)
+        for collection, changes in report.items():
+            print("{}: created={created} dropped={dropped} kept={kept}".format(collection, **changes))
+        return 0
+
+    if argv[:1] == ["advise"]:
+        findings = advise(app, api, settings)
+        for finding in findings:
+            print("{request} -> {command} {collection} filter={filter} sort={sort}".format(**finding))
+            print("    plan={} indexes={} examined={}/{} returned={}".format(
+                "/".join(finding["stages"]), finding["indexes"], finding["keys_examined"],
+                finding["docs_examined"], finding["returned"]))
+            for issue in finding["issues"]:
+                print("    !! {}".format(issue))
+        return 1 if any(finding["issues"] for finding in findings) else 0
+
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
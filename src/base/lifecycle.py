@@ -0,0 +1,102 @@
+"""
+lifecycle.py
+
+Startup helpers for the application factory in app.py. Startup is split between the process that loads the
+application (the gunicorn master with preload_app, where everything imported is shared copy-on-write by the workers)
+and each worker, which opens its own mongo client after the fork:
+    - Lifecycle: what has already been done, kept in app.extensions["lifecycle"]
+    - StartupReport: how long each startup step took, printed once the process is ready
+    - warm_schemas: build every resource's marshmallow schemas once, in the master
+    - warm_collections: resolve the model collections (pymodm creates declared indexes on first access) and open a
+      pooled connection, so the first request of a worker doesn't pay for it
+"""
+
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+from marshmallow import ValidationError
+from pymodm.connection import _get_db
+
+
+class Lifecycle(object):
+    """ Startup state of an application. Forked workers inherit the master's copy. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes_applied = False
+        self.worker_started = False
+        self.reports = []
+
+
+class StartupReport(object):
+    """ Durations of the named startup steps of one process """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name, required=True):
+        """
+        time the block as the named step. A failing optional step is reported instead of aborting startup, the
+        request that first needs it will then fail the same way it would have without warming.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.steps.append((name, time.perf_counter() - start, "failed: {}".format(e)))
+            if required:
+                raise
+        else:
+            self.steps.append((name, time.perf_counter() - start, None))
+
+    def as_dict(self):
+        return {"name": self.name, "pid": os.getpid(), "total_ms": (time.perf_counter() - self.started) * 1000,
+                "steps": [{"step": name, "ms": seconds * 1000, "error": error} for name, seconds, error in self.steps]}
+
+    def __str__(self):
+        steps = ", ".join("{} {:.1f}ms{}".format(name, seconds * 1000, " ({})".format(error) if error else "")
+                          for name, seconds, error in self.steps)
+        return "{} (pid {}) ready in {:.1f}ms: {}".format(self.name, os.getpid(),
+                                                          (time.perf_counter() - self.started) * 1000, steps)
+
+
+def warm_schemas(api):
+    """ instantiate and exercise every schema of the registered resources once """
+
+    for resource, urls, kwargs in api.resources:
+        for schema_class in (getattr(resource, "serializers", None) or {}).values():
+            schema = schema_class()
+            try:
+                schema.load({}, partial=True)
+            except ValidationError:
+                pass
+
+
+def warm_collections(models, timeout=5):
+    """
+    resolve every model collection and round trip to the server once. The work runs on a helper thread and is given
+    up on after timeout seconds, an unreachable server must not hold the worker back (or get it killed by gunicorn's
+    worker timeout) for the whole server selection timeout.
+    """
+    errors = []
+
+    def warm():
+        try:
+            for model in models:
+                model._mongometa.collection
+            _get_db().command("ping")
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=warm, name="warm-collections", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise RuntimeError("no answer from mongo within {}s".format(timeout))
+    if errors:
+        raise errors[0]
@@ -0,0 +1,254 @@
+"""
+merge.py
+
+Batch rendering of one template for many recipients (mail merge). Recipient contexts come in as NDJSON, one JSON
+object per line, and the rendered rows go out as NDJSON in input order, so neither side is ever held whole in memory:
+    - lines are read lazily and grouped into chunks of batch_size rows
+    - chunks are rendered on an executor, with at most max_in_flight of them submitted at once, which is also how far
+      reading the upload runs ahead of writing the response
+    - each chunk comes back as one block of NDJSON and is yielded as soon as it and every chunk before it are done
+A line that isn't a JSON object, or that fails to render, becomes {"row": n, "error": ...} and the batch goes on.
+Rows are numbered from 0 in upload order, blank lines are skipped.
+
+Jinja2 templates can't be pickled, so the template is compiled once in the requesting process (a broken template
+fails the request before anything is streamed) and once per pool process, which keeps its compilation keyed by
+(pk, last_updated) like the request-time TemplateRenderer.
+
+Executors, as in hashing.py:
+    - inline: render on the calling thread
+    - thread: a thread pool, only useful to overlap reading the upload with rendering, rendering holds the GIL
+    - process: a process pool, to use more than one core. Pool processes only ever run render_chunk. Every gunicorn
+      worker has its own pool, so the processes add up to gunicorn workers * workers
+When a pool process dies, the pool is replaced (see executors.py) and the chunks lost with it are resubmitted. A chunk
+that takes down a second process too is answered with an error row per line, the rest of the batch goes on. So is a
+chunk that isn't done chunk_timeout seconds after it became the oldest pending one: its pool is terminated (a thread
+pool is only abandoned) and the other chunks it held are resubmitted.
+
+Running the module benchmarks the throughput at several batch sizes, without mongo:
+    python -m src.base.merge [rows] [batch sizes, comma separated] [executor] [workers]
+"""
+
+from collections import deque
+from concurrent.futures import BrokenExecutor, TimeoutError
+from datetime import datetime
+from itertools import islice
+import os
+import sys
+import time
+
+from src.base import utils
+from src.base.encoding import dumps, loads
+from src.base.executors import WorkerPool
+from src.base.rendering import RenderError, TemplateRenderer
+
+# TemplateRenderers of a pool process, by (fields, autoescape, limits)
+_renderers = {}
+
+
+def _renderer(fields, autoescape, limits):
+    key = (fields, autoescape, limits)
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = _renderers[key] = TemplateRenderer(fields=fields, maxsize=16, autoescape=autoescape, **dict(limits))
+    return renderer
+
+
+def render_chunk(source, fields, autoescape, limits, start, lines):
+    """
+    render the rows of one chunk.
+
+    :param source: the template, {"pk", "last_updated", and the source of each of fields}
+    :param limits: the sandbox limits of every row's render, ((name, value), ...)
+    :param start: row number of the first line
+    :param lines: the NDJSON lines (bytes or str) of the chunk
+    :return: the chunk's NDJSON output, bytes
+    """
+    renderer = _renderer(fields, autoescape, limits)
+    templates = renderer.compile(source)
+    out = []
+    for row, line in enumerate(lines, start):
+        try:
+            context = loads(line)
+            if not isinstance(context, dict):
+                raise ValueError("a row must be a JSON object")
+            result = dict(row=row, **renderer.render_compiled(templates, context))
+        except (ValueError, RenderError) as e:
+            result = {"row": row, "error": str(e)}
+        out.append(dumps(result))
+    return b"\n".join(out) + b"\n"
+
+
+def chunks(lines, batch_size):
+    """ (first row number, [lines]) for every batch_size non-blank lines """
+    lines = (line for line in lines if line.strip())
+    start = 0
+    while True:
+        chunk = list(islice(lines, batch_size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+class MailMerge(object):
+    """ Renders a template for a stream of recipient contexts through a bounded, per-process executor """
+
+    def __init__(self, executor="process", workers=1, batch_size=500, max_in_flight=0, autoescape=False,
+                 fields=("subject", "body"), limits=None, chunk_timeout=60):
+        self.executor = executor
+        self.workers = max(workers, 1)
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight or 2 * self.workers
+        self.autoescape = autoescape
+        self.fields = tuple(fields)
+        # max_output, max_iterations and timeout of each row's render, see rendering.py
+        self.limits = tuple(sorted((limits or {}).items()))
+        self.chunk_timeout = chunk_timeout
+        self.pool = WorkerPool(executor=executor, workers=self.workers)
+
+    def source(self, obj):
+        """
+        the picklable source of the template obj, compiled once here to fail early.
+
+        :raises: RenderError when the template doesn't compile
+        """
+        source = {"pk": str(utils.get_field(obj, "pk")), "last_updated": utils.get_field(obj, "last_updated")}
+        for field in self.fields:
+            source[field] = utils.get_field(obj, field) or ""
+        _renderer(self.fields, self.autoescape, self.limits).compile(source)
+        return source
+
+    def render(self, obj, lines, batch_size=None):
+        """
+        render obj for every line of lines.
+
+        :param obj: the template, a model instance or a raw record
+        :param lines: iterable of NDJSON lines, e.g. the request stream
+        :param batch_size: rows per chunk, the instance's batch_size by default
+        :return: generator of NDJSON blocks (bytes), in row order
+        :raises: RenderError, before anything is generated, when the template doesn't compile
+        """
+        source = self.source(obj)
+        return self._generate(source, chunks(lines, batch_size or self.batch_size))
+
+    def _generate(self, source, batches):
+        if self.executor == "inline":
+            for start, chunk in batches:
+                yield render_chunk(source, self.fields, self.autoescape, self.limits, start, chunk)
+            return
+
+        pending = deque()
+        try:
+            for start, chunk in batches:
+                pending.append(self._submit(source, start, chunk))
+                if len(pending) >= self.max_in_flight:
+                    yield self._result(source, pending)
+            while pending:
+                yield self._result(source, pending)
+        finally:
+            # the client went away mid-stream
+            for start, chunk, pool, future in pending:
+                future.cancel()
+
+    def _submit(self, source, start, chunk):
+        pool, future = self.pool.submit(render_chunk, source, self.fields, self.autoescape, self.limits, start, chunk)
+        return start, chunk, pool, future
+
+    def _result(self, source, pending):
+        """
+        the output of the first pending chunk, resubmitting what a dead or stuck pool process took down with it.
+        The chunk has chunk_timeout seconds from the moment it is the oldest one pending.
+        """
+        start, chunk, pool, future = pending.popleft()
+        output, broken = None, []
+        for attempt in range(2):
+            try:
+                output = future.result(timeout=self.chunk_timeout)
+                break
+            except TimeoutError:
+                future.cancel()
+                self.pool.discard(pool, terminate=True)
+                broken.append(pool)
+                output = self._errors(start, chunk, "rendering the batch took longer than {}s".format(
+                    self.chunk_timeout))
+                break
+            except BrokenExecutor:
+                self.pool.discard(pool)
+                broken.append(pool)
+                if not attempt:
+                    # retried before the chunks lost along with it, so a chunk that kills its process fails alone
+                    start, chunk, pool, future = self._submit(source, start, chunk)
+        if output is None:
+            output = self._errors(start, chunk, "the rendering process died")
+        if broken:
+            for entry in pending:
+                if entry[2] in broken:
+                    # an abandoned thread pool still runs what it was given
+                    entry[3].cancel()
+            resubmitted = [self._submit(source, *entry[:2]) if entry[2] in broken else entry for entry in pending]
+            pending.clear()
+            pending.extend(resubmitted)
+        return output
+
+    @staticmethod
+    def _errors(start, chunk, error):
+        return b"".join(dumps({"row": row, "error": error}) + b"\n" for row in range(start, start + len(chunk)))
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+SAMPLE_TEMPLATE = {
+    "pk": "benchmark",
+    "last_updated": datetime(2019, 1, 2),
+    "subject": "Your {{ plan }} plan, {{ first_name }}",
+    "body": "Hi {{ first_name }} {{ last_name }},\n\n"
+            "{% for item in items %}- {{ item.name }}: {{ '%.2f' | format(item.price) }}\n{% endfor %}"
+            "Total: {{ items | sum(attribute='price') | round(2) }}\n",
+}
+
+
+def sample_rows(rows):
+    """ NDJSON recipient contexts for SAMPLE_TEMPLATE """
+    for row in range(rows):
+        yield dumps({"first_name": "First{}".format(row), "last_name": "Last", "plan": "basic",
+                     "items": [{"name": "item{}".format(item), "price": row % 100 + item} for item in range(3)]})
+
+
+def benchmark(rows=100000, batch_sizes=(50, 200, 1000, 5000), executor="process", workers=0):
+    """
+    render SAMPLE_TEMPLATE for rows recipients once per batch size, on workers processes (every core by default).
+
+    :return: [{"batch_size", "rows", "seconds", "rows_per_second", "bytes"}]
+    """
+    lines = list(sample_rows(rows))
+    results = []
+    for batch_size in batch_sizes:
+        merge = MailMerge(executor=executor, workers=workers or os.cpu_count() or 1, batch_size=batch_size)
+        try:
+            # start the pool processes (and compile in them) outside of the measurement
+            list(merge.render(SAMPLE_TEMPLATE, lines[:merge.workers], batch_size=1))
+            started = time.perf_counter()
+            size = sum(len(block) for block in merge.render(SAMPLE_TEMPLATE, lines))
+            seconds = time.perf_counter() - started
+        finally:
+            merge.shutdown()
+        results.append({"batch_size": batch_size, "rows": rows, "seconds": seconds,
+                        "rows_per_second": rows / seconds if seconds else float("inf"), "bytes": size})
+    return results
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    rows = int(argv[0]) if len(argv) > 0 else 100000
+    batch_sizes = [int(size) for size in argv[1].split(",")] if len(argv) > 1 else [50, 200, 1000, 5000]
+    executor = argv[2] if len(argv) > 2 else "process"
+    workers = int(argv[3]) if len(argv) > 3 else 0
+    for result in benchmark(rows, batch_sizes, executor=executor, workers=workers):
+        print("batch_size={batch_size:<6} rows={rows} {seconds:.2f}s {rows_per_second:,.0f} rows/s "
+              "{bytes:,} bytes".format(**result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+metrics.py
+
+Per-request timing breakdown. TimingMiddleware (outermost WSGI layer) starts a RequestTimer for every request and
+makes it current; the code paths we care about add their time to it with `timed(phase)`:
+    - auth: token verification in AuthMiddleware
+    - validation: marshmallow load in BaseResource
+    - db: every mongo command, through the CommandTimer listener passed to connect()
+    - serialization: response dumps in BaseResource
+    - hashing: PasswordHasher jobs
+
+Phases can nest (the login lookup runs during validation and counts in both), so they don't add up to the total.
+
+The pre-body phases go out in a Server-Timing header; everything, including the time spent streaming the body, is
+aggregated into latency histograms served in the Prometheus text format at the metrics path. The registry is per
+worker process, so each gunicorn worker reports its own series.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+import time
+
+from flask import request
+from pymongo import monitoring
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+_current = ContextVar("request_timer", default=None)
+
+
+class RequestTimer(object):
+    """ Accumulated seconds per phase for one request """
+
+    def __init__(self, method):
+        self.method = method
+        self.endpoint = "<unmatched>"
+        self.status = None
+        self.started = time.perf_counter()
+        self.phases = {}
+        # mongo commands issued, counted by querylog.QueryMonitor
+        self.queries = 0
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self):
+        """ Server-Timing header value, in milliseconds """
+        parts = ["{};dur={:.2f}".format(phase, seconds * 1000) for phase, seconds in self.phases.items()]
+        if self.queries:
+            parts.append('queries;desc="{}"'.format(self.queries))
+        parts.append("total;dur={:.2f}".format((time.perf_counter() - self.started) * 1000))
+        return ", ".join(parts)
+
+
+def current_timer():
+    return _current.get()
+
+
+@contextmanager
+def timed(phase):
+    """ add the time spent in the block to the current request's phase, a no-op outside of a request """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, time.perf_counter() - start)
+
+
+def record_endpoint():
+    """ flask before_request hook labelling the timer with the matched url rule """
+    timer = _current.get()
+    if timer is not None and request.url_rule is not None:
+        timer.endpoint = request.url_rule.rule
+
+
+class CommandTimer(monitoring.CommandListener):
+    """ pymongo listener adding every command's server round trip to the db phase """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        timer = _current.get()
+        if timer is not None:
+            timer.add("db", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+class Histogram(object):
+    """ Prometheus style cumulative histogram, one series per label set """
+
+    def __init__(self, name, description, labels, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, label_values, seconds):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = ",".join('{}="{}"'.format(label, _escape(value))
+                                  for label, value in zip(self.labels, label_values))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, labels, bound, cumulative))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.name, labels, count))
+                lines.append("{}_sum{{{}}} {}".format(self.name, labels, total))
+                lines.append("{}_count{{{}}} {}".format(self.name, labels, count))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry(object):
+    """ The worker's histograms plus stats callbacks rendered as gauges """
+
+    def __init__(self):
+        self.durations = Histogram("app_request_duration_seconds", "Request latency, body streaming included",
+                                   ("endpoint", "method", "status"))
+        self.phases = Histogram("app_request_phase_seconds", "Time spent per phase of a request",
+                                ("endpoint", "method", "phase"))
+        self.queries = Histogram("app_request_queries", "Mongo commands issued per request", ("endpoint", "method"),
+                                 buckets=QUERY_BUCKETS)
+        self._stats = {}
+
+    def register_stats(self, name, stats):
+        """ expose stats() -> {key: number} as gauges named <name>_<key>, replacing any stats registered as name """
+        self._stats[name] = stats
+
+    def observe(self, timer):
+        self.durations.observe((timer.endpoint, timer.method, timer.status), time.perf_counter() - timer.started)
+        for phase, seconds in timer.phases.items():
+            self.phases.observe((timer.endpoint, timer.method, phase), seconds)
+        self.queries.observe((timer.endpoint, timer.method), timer.queries)
+
+    def render(self):
+        lines = self.durations.render() + self.phases.render() + self.queries.render()
+        for name, stats in sorted(self._stats.items()):
+            for key, value in sorted(stats().items()):
+                if isinstance(value, (int, float)):
+                    lines.append("# TYPE {}_{} gauge".format(name, key))
+                    lines.append("{}_{} {}".format(name, key, value))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class TimedIterable(object):
+    """ Response iterable that keeps the timer current while the body is produced and records it on close """
+
+    def __init__(self, result, timer, registry):
+        self.result = result
+        self.timer = timer
+        self.registry = registry
+
+    def __iter__(self):
+        iterator = iter(self.result)
+        while True:
+            token = _current.set(self.timer)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.result, "close"):
+                self.result.close()
+        finally:
+            self.registry.observe(self.timer)
+
+
+class TimingMiddleware(object):
+    '''
+    WSGI middleware timing every request, adding the Server-Timing header and serving the metrics path
+    '''
+
+    def __init__(self, app, metrics_path="/metrics", registry=registry):
+        self.app = app
+        self.metrics_path = metrics_path
+        self.registry = registry
+
+    def __call__(self, environ, start_response):
+
+        if self.metrics_path and environ.get("PATH_INFO") == self.metrics_path:
+            body = self.registry.render().encode("utf-8")
+            start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4"),
+                                      ("Content-Length", str(len(body)))])
+            return [body]
+
+        timer = RequestTimer(environ.get("REQUEST_METHOD"))
+
+        def _start_response(status, headers, exc_info=None):
+            timer.status = status.split(" ", 1)[0]
+            headers.append(("Server-Timing", timer.server_timing()))
+            return start_response(status, headers, exc_info)
+
+        token = _current.set(timer)
+        try:
+            result = self.app(environ, _start_response)
+        except Exception:
+            timer.status = "500"
+            self.registry.observe(timer)
+            raise
+        finally:
+            _current.reset(token)
+        return TimedIterable(result, timer, self.registry)
@@ -1,5 +1,42 @@
-from werkzeug.wrappers import Request, Response
+from io import BytesIO
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+from werkzeug.wrappers import Response
+from src.base.cache import LRUCache
+from src.base.metrics import timed
+import hashlib
+import json
 import jwt
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# content types worth compressing, matched against the start of the Content-Type header
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml")
+
+
+class TokenCache(LRUCache):
+    '''
+    Bounded LRU cache of verified token claims, keyed by a hash of the token.
+    Entries expire after ttl seconds or at the token's exp, whichever comes first.
+    '''
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token):
+        """return the cached claims for token, or None if absent or expired"""
+        return super(TokenCache, self).get(self._key(token))
+
+    def set(self, token, claims):
+        """cache the verified claims of token"""
+        exp = claims.get("exp")
+        super(TokenCache, self).set(self._key(token), claims,
+                                    expires_at=exp if isinstance(exp, (int, float)) else None)
 
 
 class AuthMiddleware(object):
@@ -11,12 +48,15 @@ class AuthMiddleware(object):
         self.app = app
         self.ignored_endpoints = ignored_endpoints
         self.settings = settings
+        self.token_cache = TokenCache(maxsize=getattr(settings, "AUTH_TOKEN_CACHE_SIZE", 1024),
+                                      ttl=getattr(settings, "AUTH_TOKEN_CACHE_TTL", 300))
 
     def __call__(self, environ, start_response):
 
-        request = Request(environ)
-        user_context = self.validate_token(token=request.headers.get("Authorization", None))
-        if not user_context and not self.check_ignored_endpoints(path=request.path):
+        # read the header and path straight from environ instead of building a werkzeug Request
+        with timed("auth"):
+            user_context = self.validate_token(token=environ.get("HTTP_AUTHORIZATION"))
+        if not user_context and not self.check_ignored_endpoints(path=environ.get("PATH_INFO", "")):
             res = Response("Authorization failed", content_type='application/json', status=401)
             return res(environ, start_response)
 
@@ -33,8 +73,12 @@ class AuthMiddleware(object):
         """
         try:
             token = token.split("Bearer ")[1]
-            data = jwt.decode(token, self.settings.JWT_SECRET_KEY, algorithms=self.settings.JWT_ALGORITHM)
-            return data
+            data = self.token_cache.get(token)
+            if data is None:
+                data = jwt.decode(token, self.settings.JWT_SECRET_KEY, algorithms=self.settings.JWT_ALGORITHM)
+                self.token_cache.set(token, data)
+            # handlers get their own copy so they can't alter the cached claims
+            return dict(data)
         except Exception as e:
             print(e)
         return None
@@ -58,3 +102,190 @@ class AuthMiddleware(object):
             if i[:] == relative_path[:l]:
                 return True
         return False
+
+
+class CompressionMiddleware(object):
+    '''
+    WSGI middleware compressing responses with gzip, or with zstd when the zstandard package is installed and the
+    client accepts it at least as much, and inflating gzip request bodies.
+
+    Responses with a known length are compressed whole and only from min_size bytes. Streamed responses (no
+    Content-Length) are compressed chunk by chunk, each chunk flushed so the client still receives it straight away.
+    304/204 responses, HEAD requests, payloads that already carry a Content-Encoding and non textual content types
+    are passed through. Strong ETags are weakened on compressed responses, the bytes differ from the identity ones.
+    '''
+
+    def __init__(self, app, min_size=1024, level=6, zstd_level=3, max_request_bytes=10 * 1024 * 1024):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.zstd_level = zstd_level
+        self.max_request_bytes = max_request_bytes
+
+    def __call__(self, environ, start_response):
+
+        if environ.get("HTTP_CONTENT_ENCODING", "").strip().lower() == "gzip":
+            error = self.inflate_request(environ)
+            if error is not None:
+                return error(environ, start_response)
+
+        encoding = self.negotiate(environ)
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        captured = []
+        # what the app passes to the write() callable goes out ahead of its iterable, through the same path
+        written = []
+
+        def _start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return written.append
+
+        result = self.app(environ, _start_response)
+        chunks = _written_first(written, iter(result))
+        if not captured:
+            # the app calls start_response along with its first chunk
+            first = next(chunks, b"")
+            chunks = _chain(first, chunks)
+        status, headers, exc_info = captured
+        headers = Headers(headers)
+
+        if not self.compressible(status, headers):
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return _closing(chunks, result)
+
+        length = headers.get("Content-Length", type=int)
+        if length is not None:
+            if length < self.min_size:
+                headers.add("Vary", "Accept-Encoding")
+                start_response(status, headers.to_wsgi_list(), exc_info)
+                return _closing(chunks, result)
+            try:
+                with timed("compression"):
+                    compressor = self.compressor(encoding)
+                    body = compressor.compress(b"".join(chunks)) + compressor.flush()
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            headers["Content-Length"] = str(len(body))
+            self.set_encoding(headers, encoding)
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return [body]
+
+        self.set_encoding(headers, encoding)
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return _closing(self.compress_stream(chunks, encoding), result)
+
+    def negotiate(self, environ):
+        """ the content coding to respond with, None for identity """
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            return None
+        accepted = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        gzip_quality = accepted.quality("gzip")
+        if zstandard is not None and accepted.quality("zstd") and accepted.quality("zstd") >= gzip_quality:
+            return "zstd"
+        return "gzip" if gzip_quality else None
+
+    @staticmethod
+    def compressible(status, headers):
+        code = int(status.split(" ", 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        if "Content-Encoding" in headers or "no-transform" in headers.get("Cache-Control", ""):
+            return False
+        return headers.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES)
+
+    def compressor(self, encoding):
+        if encoding == "zstd":
+            return zstandard.ZstdCompressor(level=self.zstd_level).compressobj()
+        # wbits 16 + 15 writes a gzip header and trailer around the deflate stream
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    @staticmethod
+    def set_encoding(headers, encoding):
+        headers["Content-Encoding"] = encoding
+        headers.add("Vary", "Accept-Encoding")
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = "W/" + etag
+
+    def compress_stream(self, chunks, encoding):
+        compressor = self.compressor(encoding)
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK if encoding == "zstd" else zlib.Z_SYNC_FLUSH
+        for chunk in chunks:
+            if not chunk:
+                continue
+            with timed("compression"):
+                data = compressor.compress(chunk) + compressor.flush(flush_mode)
+            yield data
+        yield compressor.flush()
+
+    def inflate_request(self, environ):
+        """
+        replace a gzip request body by its inflated content
+
+        :return: an error Response when the body is too large or not valid gzip, None otherwise
+        """
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or -1)
+        except ValueError:
+            length = -1
+        if length > self.max_request_bytes:
+            return self._error(413, "request body too large")
+        compressed = environ["wsgi.input"].read(length if length >= 0 else self.max_request_bytes + 1)
+        if len(compressed) > self.max_request_bytes:
+            # no Content-Length, and the body didn't end within the limit
+            return self._error(413, "request body too large")
+        decompressor = zlib.decompressobj(31)
+        try:
+            with timed("compression"):
+                body = decompressor.decompress(compressed, self.max_request_bytes + 1)
+        except zlib.error:
+            return self._error(400, "request body is not valid gzip")
+        if len(body) > self.max_request_bytes or decompressor.unconsumed_tail:
+            return self._error(413, "request body too large")
+        if not decompressor.eof:
+            # zlib hands back what it could inflate of a truncated stream without complaining
+            return self._error(400, "request body is a truncated gzip stream")
+        if decompressor.unused_data:
+            return self._error(400, "request body has data after the gzip stream")
+
+        environ["wsgi.input"] = BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        del environ["HTTP_CONTENT_ENCODING"]
+        return None
+
+    @staticmethod
+    def _error(status, desc):
+        return Response(json.dumps({"desc": desc}), content_type="application/json", status=status)
+
+
+def _written_first(written, chunks):
+    """ the chunks of an app's iterable, each preceded by what it passed to write() so far """
+    for chunk in chunks:
+        while written:
+            yield written.pop(0)
+        yield chunk
+    while written:
+        yield written.pop(0)
+
+
+def _chain(first, rest):
+    yield first
+    for chunk in rest:
+        yield chunk
+
+
+class _closing(object):
+    """ iterable over chunks that closes the original response iterable as WSGI requires """
+
+    def __init__(self, chunks, result):
+        self.chunks = chunks
+        self.result = result
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        if hasattr(self.result, "close"):
+            self.result.close()
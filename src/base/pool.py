@@ -0,0 +1,109 @@
+"""
+pool.py
+
+Connection pool monitoring. PoolMonitor is a pymongo pool listener (passed to connect() in models.py) tracking, for
+the worker process:
+    - open: connections currently open
+    - checked_out: connections in use by an operation
+    - waiting: operations waiting for a connection
+    - wait_seconds_total / wait_seconds_max: time spent waiting for a connection
+    - timeouts: check outs given up on after waitQueueTimeoutMS, i.e. requests failed fast instead of queueing
+
+Time spent waiting is also added to the current request's pool_wait phase. The stats are served on the metrics
+endpoint as the app_mongo_pool gauges.
+"""
+
+from threading import Lock, local
+import time
+
+from pymongo import monitoring
+from pymongo.monitoring import ConnectionCheckOutFailedReason
+
+from src.base.metrics import current_timer
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.cleared = 0
+        self._lock = Lock()
+        # check outs block the thread asking for the connection, so the wait start is per thread
+        self._local = local()
+
+    def _waited(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        if started is None:
+            return 0.0
+        waited = time.perf_counter() - started
+        timer = current_timer()
+        if timer is not None:
+            timer.add("pool_wait", waited)
+        return waited
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.waiting -= 1
+            self.wait_seconds_total += waited
+            if event.reason == ConnectionCheckOutFailedReason.TIMEOUT:
+                self.timeouts += 1
+            else:
+                self.failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {"open": self.open, "checked_out": self.checked_out, "waiting": self.waiting,
+                    "checkouts": self.checkouts, "wait_seconds_total": self.wait_seconds_total,
+                    "wait_seconds_max": self.wait_seconds_max, "timeouts": self.timeouts,
+                    "failures": self.failures, "cleared": self.cleared}
+
+
+pool_monitor = PoolMonitor()
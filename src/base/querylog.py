@@ -0,0 +1,123 @@
+"""
+querylog.py
+
+Mongo command monitoring. QueryMonitor is a pymongo command listener (passed to connect() in models.py) that:
+    - counts the commands of every request on its RequestTimer, so N+1 patterns show up in the Server-Timing header and
+      the app_request_queries histogram
+    - logs commands slower than slow_ms with the endpoint that issued them, the filter shape and, optionally, a plan
+      summary from explain (an extra round trip, only paid for the slow ones)
+    - warns when a request issues more than budget commands
+
+query_budget() turns the budget into an assertion, e.g. around test client calls:
+
+    with query_budget(2):
+        client.get("/template", headers=headers)
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+
+from flask import has_request_context, request
+from pymongo import monitoring
+from pymodm.connection import _get_db
+
+from src.base.indexes import EXPLAINABLE_COMMANDS, _explainable, _shape, summarize_plan
+from src.base.metrics import current_timer
+
+logger = logging.getLogger(__name__)
+
+_budgets = ContextVar("query_budgets", default=())
+
+
+class QueryBudgetExceeded(AssertionError):
+    """ Raised by query_budget when the block issued more commands than allowed """
+
+
+class QueryBudget(object):
+
+    def __init__(self, max_queries):
+        self.max_queries = max_queries
+        self.commands = []
+
+
+@contextmanager
+def query_budget(max_queries):
+    """
+    Fail when the block issues more than max_queries mongo commands on the current thread.
+
+    :raises QueryBudgetExceeded: listing the commands that were issued
+    """
+    budget = QueryBudget(max_queries)
+    token = _budgets.set(_budgets.get() + (budget,))
+    try:
+        yield budget
+    finally:
+        _budgets.reset(token)
+    if len(budget.commands) > max_queries:
+        raise QueryBudgetExceeded("{} mongo commands issued, the budget is {}: {}".format(
+            len(budget.commands), max_queries, ", ".join(budget.commands)))
+
+
+def _endpoint():
+    timer = current_timer()
+    if timer is not None:
+        return timer.endpoint
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return "<no request>"
+
+
+class QueryMonitor(monitoring.CommandListener):
+    """
+    :param slow_ms: commands taking longer are logged, 0 disables the slow log
+    :param explain: add the plan summary of slow commands to the log line
+    :param budget: commands a request may issue before a warning is logged, 0 disables the check
+    """
+
+    def __init__(self, slow_ms=100, explain=False, budget=0):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.budget = budget
+        # request_id -> (database, command) of the commands in flight, only kept when the slow log is on
+        self._started = {}
+
+    def started(self, event):
+        if self.slow_ms:
+            self._started[event.request_id] = (event.database_name, event.command)
+
+        budgets = _budgets.get()
+        if budgets:
+            label = "{} {}".format(event.command_name, event.command.get(event.command_name))
+            for budget in budgets:
+                budget.commands.append(label)
+
+        timer = current_timer()
+        if timer is not None:
+            timer.queries += 1
+            if timer.queries == self.budget + 1 and self.budget:
+                logger.warning("%s %s issued more than %d mongo commands", timer.method, timer.endpoint, self.budget)
+
+    def succeeded(self, event):
+        started = self._started.pop(event.request_id, None)
+        if started is not None and event.duration_micros >= self.slow_ms * 1000:
+            self.log_slow(event, *started)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+    def log_slow(self, event, database_name, command):
+        collection = command.get(event.command_name)
+        plan = ""
+        if self.explain and event.command_name in EXPLAINABLE_COMMANDS:
+            try:
+                explain = _get_db().client[database_name].command("explain", _explainable(command),
+                                                                   verbosity="queryPlanner")
+                summary = summarize_plan(explain)
+                plan = " plan={} indexes={} issues={}".format("/".join(summary["stages"]), summary["indexes"],
+                                                              summary["issues"])
+            except Exception as e:
+                plan = " plan=<explain failed: {}>".format(e)
+        logger.warning("slow mongo command %.1fms on %s: %s %s filter=%s sort=%s%s",
+                       event.duration_micros / 1000.0, _endpoint(), event.command_name, collection,
+                       _shape(command.get("filter", command.get("query", {}))), command.get("sort"), plan)
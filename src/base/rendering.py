@@ -0,0 +1,231 @@
+"""
+rendering.py
+
+Rendering of stored templates with Jinja2. Template sources come from users, so they are compiled in a
+BoundedSandbox: Jinja2's SandboxedEnvironment (no attribute access to internals, no unsafe calls, range() capped) that
+also bounds what a single render may cost:
+    - max_output: characters a rendered field may have. Operations that would build a larger value at once, "*"
+      repetition, "**", padding and format widths, str.replace, are refused before they allocate anything
+    - max_iterations: loop iterations per render, across every {% for %} of the template
+    - timeout: seconds a render may take, checked on every loop iteration, call and output chunk
+Values built by an operator, a filter or a method call are checked against max_output too, so a template can't grow
+a string or a list by doubling it in a loop.
+Variables missing from the context are an error rather than silently rendered empty.
+
+TemplateRenderer keeps the compiled templates of an object in an LRUCache keyed by (pk, last_updated), so a template
+is compiled once per worker and version, and an edit never renders from a stale compilation.
+"""
+
+from functools import wraps
+import re
+import threading
+import time
+
+from jinja2 import StrictUndefined, TemplateError, nodes
+from jinja2.exceptions import SecurityError
+from jinja2.runtime import markup_join, str_join
+from jinja2.sandbox import SandboxedEnvironment
+from jinja2.visitor import NodeTransformer
+
+from src.base import utils
+from src.base.cache import LRUCache
+
+# str methods and filters whose result grows with an integer argument
+PADDING_METHODS = ("center", "ljust", "rjust", "zfill", "expandtabs")
+PADDING_FILTERS = ("center", "indent", "wordwrap", "truncate")
+# values whose size is checked after every call that may have grown them
+SIZED = (str, bytes, list, tuple, dict, set)
+# a width or precision in a format string, {:>N} or %N.Ms
+FORMAT_WIDTH = re.compile(r"\d+")
+
+
+class RenderError(ValueError):
+    """ the template doesn't compile, or fails to render with the given context """
+
+
+class BoundedSandbox(SandboxedEnvironment):
+    """ SandboxedEnvironment bounding the output size, the loop iterations and the duration of each render """
+
+    intercepted_binops = frozenset(["*", "**", "%", "+"])
+
+    def __init__(self, max_output=512 * 1024, max_iterations=100000, timeout=1.0, **kwargs):
+        super(BoundedSandbox, self).__init__(**kwargs)
+        self.max_output = max_output
+        self.max_iterations = max_iterations
+        self.timeout = timeout
+        # counters of the render in progress, renders run one at a time per thread
+        self.state = threading.local()
+        for name in PADDING_FILTERS + ("format", "replace"):
+            self.filters[name] = self._bounded(self.filters[name])
+
+    def _parse(self, source, name, filename):
+        return Bounds().visit(super(BoundedSandbox, self)._parse(source, name, filename))
+
+    def start(self):
+        """ reset the counters, called before each render """
+        self.state.iterations = 0
+        self.state.deadline = time.monotonic() + self.timeout
+
+    def check_time(self):
+        deadline = getattr(self.state, "deadline", None)
+        if deadline is not None and time.monotonic() > deadline:
+            raise SecurityError("the template took longer than {}s to render".format(self.timeout))
+
+    def check_size(self, size):
+        if size > self.max_output:
+            raise SecurityError("the template builds a value over {} characters".format(self.max_output))
+
+    def check_value(self, value):
+        if isinstance(value, SIZED):
+            self.check_size(len(value))
+        return value
+
+    def check_format(self, format_string):
+        for width in FORMAT_WIDTH.findall(format_string):
+            self.check_size(int(width))
+
+    def check_replace(self, string, old, new):
+        if isinstance(string, str) and isinstance(old, str) and isinstance(new, str):
+            # every occurrence of old replaced, and with an empty old, new inserted between every character
+            self.check_size(len(string) + (len(string) // max(len(old), 1) + 1) * len(new))
+
+    def check_arguments(self, args, kwargs):
+        for value in list(args) + list(kwargs.values()):
+            if isinstance(value, int) and not isinstance(value, bool):
+                self.check_size(abs(value))
+
+    def iterate(self, iterable):
+        """ the iterable of a {% for %}, counting its iterations against the render's budget """
+        for item in iterable:
+            self.state.iterations = getattr(self.state, "iterations", 0) + 1
+            if self.state.iterations > self.max_iterations:
+                raise SecurityError("the template loops more than {} times".format(self.max_iterations))
+            if not self.state.iterations % 100:
+                self.check_time()
+            yield item
+
+    def concat(self, *values):
+        """ the ~ operator """
+        return self.check_value((markup_join if self.autoescape else str_join)(values))
+
+    def _bounded(self, function):
+        """ a filter refusing widths, counts and format strings over max_output, and results over it """
+
+        @wraps(function)
+        def bounded(*args, **kwargs):
+            if function.__name__ == "do_format" and args and isinstance(args[0], str):
+                self.check_format(args[0])
+            elif function.__name__ == "do_replace" and len(args) >= 4:
+                self.check_replace(str(args[1]), args[2], args[3])
+            self.check_arguments(args[1:], kwargs)
+            return self.check_value(function(*args, **kwargs))
+
+        return bounded
+
+    def call_binop(self, context, operator, left, right):
+        if operator == "*":
+            for sequence, count in ((left, right), (right, left)):
+                if isinstance(sequence, SIZED) and isinstance(count, int):
+                    self.check_size(len(sequence) * count)
+            if isinstance(left, int) and isinstance(right, int):
+                self.check_size((left.bit_length() + right.bit_length()) // 8)
+        elif operator == "**":
+            if isinstance(left, int) and isinstance(right, int) and right > 0:
+                self.check_size(max(left.bit_length(), 1) * right // 8)
+        elif operator == "%" and isinstance(left, str):
+            self.check_format(left)
+        return self.check_value(super(BoundedSandbox, self).call_binop(context, operator, left, right))
+
+    def call(__self, __context, __obj, *args, **kwargs):
+        __self.check_time()
+        owner = getattr(__obj, "__self__", None)
+        name = getattr(__obj, "__name__", None)
+        if isinstance(owner, str):
+            if name in PADDING_METHODS:
+                __self.check_arguments(args, kwargs)
+            elif name in ("format", "format_map"):
+                __self.check_format(owner)
+            elif name == "replace" and len(args) >= 2:
+                __self.check_replace(owner, args[0], args[1])
+        result = super(BoundedSandbox, __self).call(__context, __obj, *args, **kwargs)
+        # list.extend() and the like grow their owner
+        __self.check_value(owner)
+        return __self.check_value(result)
+
+    def render(self, template, context):
+        """ render template, refusing output over max_output characters """
+        self.start()
+        size, parts = 0, []
+        for part in template.generate(context):
+            size += len(part)
+            self.check_size(size)
+            self.check_time()
+            parts.append(part)
+        return "".join(parts)
+
+
+class Bounds(NodeTransformer):
+    """ routes loops and ~ of a parsed template through BoundedSandbox.iterate() and concat() """
+
+    def visit_For(self, node):
+        node = self.generic_visit(node)
+        node.iter = nodes.Call(nodes.EnvironmentAttribute("iterate"), [node.iter], [], None, None,
+                               lineno=node.iter.lineno)
+        return node
+
+    def visit_Concat(self, node):
+        node = self.generic_visit(node)
+        return nodes.Call(nodes.EnvironmentAttribute("concat"), node.nodes, [], None, None, lineno=node.lineno)
+
+
+def make_environment(autoescape=False, max_output=512 * 1024, max_iterations=100000, timeout=1.0):
+    return BoundedSandbox(autoescape=autoescape, undefined=StrictUndefined, keep_trailing_newline=True,
+                          max_output=max_output, max_iterations=max_iterations, timeout=timeout)
+
+
+class TemplateRenderer(object):
+    """ Renders the text fields of template objects (model instances or raw records) """
+
+    def __init__(self, fields=("subject", "body"), maxsize=256, ttl=3600, autoescape=False, **limits):
+        """ limits: max_output, max_iterations and timeout of the BoundedSandbox """
+        self.fields = fields
+        self.environment = make_environment(autoescape=autoescape, **limits)
+        self.compiled = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def compile(self, obj):
+        """
+        the compiled templates of obj, {field: jinja2 Template}, from the cache when this version was compiled before.
+
+        :raises: RenderError on a syntax error
+        """
+        key = (str(utils.get_field(obj, "pk")), utils.get_field(obj, "last_updated"))
+        templates = self.compiled.get(key)
+        if templates is None:
+            try:
+                templates = dict((field, self.environment.from_string(utils.get_field(obj, field) or ""))
+                                 for field in self.fields)
+            except TemplateError as e:
+                raise RenderError("{}: {}".format(type(e).__name__, e))
+            self.compiled.set(key, templates)
+        return templates
+
+    @staticmethod
+    def render_compiled(templates, context):
+        """
+        render already compiled templates with context.
+
+        :return: {field: rendered text}
+        :raises: RenderError when rendering fails
+        """
+        try:
+            return dict((field, template.environment.render(template, context))
+                        for field, template in templates.items())
+        except Exception as e:
+            # the sandbox raises SecurityError, bad operations on context values raise plain python errors
+            raise RenderError("{}: {}".format(type(e).__name__, e))
+
+    def render(self, obj, context):
+        return self.render_compiled(self.compile(obj), context or {})
+
+    def stats(self):
+        return self.compiled.stats()
@@ -1,18 +1,74 @@
+from datetime import datetime, timezone
+import hashlib
+
+import pymongo
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
 from flask_restful import Resource
-from flask import request, make_response, abort
+from flask import request, make_response, abort, Response, stream_with_context
+from werkzeug.http import http_date, quote_etag
 from marshmallow import EXCLUDE, ValidationError
+from pymodm.fields import DateTimeField
+
+from src.base import indexes, utils
+from src.base.encoding import dumps
+from src.base.metrics import timed
+from src.base.serializers import compile_schema, schema_attributes
+
+# ?<field>__<operator>= filter operators, no operator means eq
+FILTER_OPERATORS = {"eq": "$eq", "in": "$in", "gt": "$gt", "gte": "$gte", "lt": "$lt", "lte": "$lte"}
+# list query params that are never filters
+RESERVED_PARAMS = ("limit", "cursor", "fields", "sort", "ordered")
 
 
 class BaseResource(Resource):
 
+    default_limit = 50
+    max_limit = 500
+    # list pages are streamed as they are read from mongo, in cursor batches of stream_batch_size
+    stream_list = True
+    stream_batch_size = 100
+    # whether post accepts a JSON array, and how many items at once
+    allow_bulk = False
+    max_bulk = 1000
+    # ListCache for serialized list responses, None disables it
+    list_cache = None
+    # read through the service's raw, projected view instead of building model instances
+    raw_reads = False
+    # attributes read beyond the response schema's: the pagination, validator and ownership keys
+    raw_read_fields = ("date_created", "last_updated", "user_id")
+    # distinct ?fields= selections whose compiled serializer and reader are kept per resource
+    max_sparse_views = 128
+    # list filters, {response schema field: operators allowed on it}, e.g. ?subject=x&date_created__gte=...
+    filter_fields = {}
+    # fields lists can be ordered by with ?sort=field or ?sort=-field, and the ordering without it
+    sort_fields = ("date_created",)
+    default_sort = "-date_created"
+    # filter and sort combinations no index in the model's Meta.indexes serves are served with a "warn"ing (printed
+    # once per combination), or "reject"ed with a 409 when the client asked for them. The plain list, without filters
+    # and in default_sort order, is only ever warned about.
+    unindexed_queries = "warn"
+
     def __init__(self):
         """
 
         """
 
+    def dispatch_request(self, *args, **kwargs):
+        # an exhausted connection pool, an unreachable server or a read over maxTimeMS fail fast with a 503
+        try:
+            return super(BaseResource, self).dispatch_request(*args, **kwargs)
+        except (ConnectionFailure, ExecutionTimeout) as e:
+            print(e)
+            return abort(503, {"desc": "the database is unavailable, try again later"})
+
+    @property
+    def reader(self):
+        """where reads go: the raw read-only view when raw_reads is on, otherwise the service itself"""
+        return self.raw_reader if self.raw_reads else self.service_klass
+
     def query(self):
         """this is the query that to the database"""
-        return self.service_klass.objects
+        return self.reader.objects
 
     def limit_query(self, query, **kwargs):
         """limit the results of a query to what want the user to see"""
@@ -24,14 +80,298 @@ class BaseResource(Resource):
     def limit_get(self, obj, **kwargs):
         """limit the ability to view a singular object to the actual owner of the object"""
 
-        model_owner_id = getattr(obj, "user_id", None)
-        model_owner_pk = getattr(obj, "pk", None)
+        model_owner_id = utils.get_field(obj, "user_id")
+        model_owner_pk = utils.get_field(obj, "pk")
         user_context = request.environ.get("user_context")
         user_id = user_context.get("id")
         if (model_owner_id and str(model_owner_id) == user_id) or (model_owner_pk and str(model_owner_pk) == user_id):
             return obj
         return abort(401, {"desc": "unauthorized"})
 
+    def write_filter(self, obj_id, **kwargs):
+        """the filter a put or delete is applied with, it only matches the object if the user owns it"""
+        user_context = request.environ.get("user_context")
+        if not user_context:
+            # only the auth-ignored endpoints are reached without one
+            return abort(401, {"desc": "unauthorized"})
+        return {"_id": self.service_klass._prepare_id(obj_id), "user_id": user_context.get("id")}
+
+    def object_validators(self, obj):
+        """
+        the ETag and Last-Modified of a single object, both derived from its last_updated.
+
+        :return: (etag, last_modified), (None, None) when the object has no last_updated
+        """
+        last_updated = utils.get_field(obj, "last_updated")
+        if last_updated is None:
+            return None, None
+        return str(utils.to_millis(last_updated)), last_updated
+
+    def list_validators(self, query):
+        """
+        the ETag of a list, from the count and the newest last_updated of everything the query matches (one $group
+        over the query) and the request's query string, without reading the page itself. Only last_updated is
+        projected, so the $group is answered from an index alone when one holds the filter fields and last_updated;
+        the index serving that ordering is hinted when there is one.
+
+        Lists get no Last-Modified: removing an object (a soft delete included) leaves the newest last_updated of
+        what is left unchanged, only the count in the ETag tells the lists apart.
+
+        :return: (etag, None)
+        """
+        field = self.model_field("last_updated")
+        name = field.mongo_name if field else "last_updated"
+        equality, ranges = indexes.filter_shape(query.raw_query)
+        index = indexes.serving_index(self.service_klass.model_class, equality, ranges, [(name, pymongo.DESCENDING)])
+        options = {"hint": index} if index else {}
+        # the unprojected query, the reader's projection would come first and read whole documents
+        summary = next(self.service_klass.objects.raw(query.raw_query).aggregate(
+            {"$project": {"_id": 0, name: 1}},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "last_updated": {"$max": "$" + name}}},
+            **options), None) or {}
+        last_updated = summary.get("last_updated")
+        key = "{}|{}|{}".format(request.query_string.decode("latin-1"), summary.get("count", 0),
+                                utils.to_millis(last_updated) if last_updated else "")
+        return hashlib.md5(key.encode("utf-8")).hexdigest(), None
+
+    def validator_headers(self, etag, last_modified):
+        """the ETag/Last-Modified response headers"""
+        headers = {}
+        if etag is not None:
+            headers["ETag"] = quote_etag(etag)
+        if last_modified is not None:
+            headers["Last-Modified"] = http_date(last_modified)
+        return headers
+
+    def not_modified(self, etag, last_modified):
+        """
+        evaluate If-None-Match (or, without it, If-Modified-Since) against the validators.
+
+        :return: a 304 Response to send instead of the body, None if the client's copy is stale
+        """
+        if etag is None:
+            return None
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since and last_modified is not None:
+            # http dates have second precision, the stored dates are naive utc
+            fresh = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+        else:
+            fresh = False
+        if not fresh:
+            return None
+        return Response(status=304, headers=self.validator_headers(etag, last_modified))
+
+    def if_match(self):
+        """
+        the last_updated an If-Match header pins a write to, for optimistic concurrency.
+
+        :return: the datetime, or None when there is no If-Match (or it is *)
+        """
+        if not request.if_match or request.if_match.star_tag:
+            return None
+        # weak tags too, the compression middleware weakens the ETags of the responses it compresses
+        tags = request.if_match.as_set(include_weak=True)
+        if len(tags) != 1:
+            return abort(412, {"desc": "If-Match must carry a single ETag"})
+        try:
+            return utils.from_millis(tags.pop())
+        except (TypeError, ValueError, OverflowError):
+            return abort(412, {"desc": "If-Match does not match the current version"})
+
+    def get_limit(self):
+        """read the page size from the limit query param, capped at max_limit"""
+        limit = request.args.get("limit", self.default_limit)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return abort(409, {"limit": ["Not a valid integer."]})
+        if limit < 1:
+            return abort(409, {"limit": ["Must be greater than or equal to 1."]})
+        return min(limit, self.max_limit)
+
+    def model_field(self, attribute):
+        """the model field behind an attribute, None if the model doesn't declare it"""
+        model = self.service_klass.model_class
+        for field in model._mongometa.get_fields():
+            if field.attname == attribute:
+                return field
+        return None
+
+    def get_sort(self):
+        """
+        read the ordering from the sort query param, default_sort without it.
+
+        :return: (the sort param, e.g. -date_created, the attribute, pymongo direction)
+        """
+        sort = request.args.get("sort", self.default_sort)
+        attribute = sort[1:] if sort.startswith("-") else sort
+        if attribute not in self.sort_fields:
+            return abort(409, {"sort": ["Must be one of: {}".format(
+                ", ".join(name + ", -" + name for name in self.sort_fields))]})
+        return sort, attribute, pymongo.DESCENDING if sort.startswith("-") else pymongo.ASCENDING
+
+    def sort_spec(self):
+        """the requested ordering as given to order_by, _id breaking the ties"""
+        sort, attribute, direction = self.get_sort()
+        field = self.model_field(attribute)
+        return [(field.mongo_name if field else attribute, direction), ("_id", direction)]
+
+    def filter_value(self, param, field, value):
+        """deserialize a filter value with its schema field, dates are stored as naive utc"""
+        try:
+            value = field.deserialize(value)
+        except ValidationError as e:
+            return abort(409, {param: e.messages})
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def filter_query(self, query, **kwargs):
+        """
+        apply the request's filters (see filter_fields) to the limited query, and check the filter and the ordering
+        against the model's indexes (see unindexed_queries).
+
+        :param query: the limited query
+        :return: the filtered query
+        """
+        schema = getattr(self.response_serializer, "schema", self.response_serializer)
+        conditions = {}
+        for param, value in request.args.items(multi=True):
+            if param in RESERVED_PARAMS:
+                continue
+            name, _, operator = param.partition("__")
+            operator = operator or "eq"
+            if name not in self.filter_fields:
+                continue
+            if operator not in self.filter_fields[name] or operator not in FILTER_OPERATORS:
+                return abort(409, {param: ["Filtering {} supports: {}".format(
+                    name, ", ".join(self.filter_fields[name]))]})
+            field = schema.fields[name]
+            if operator == "in":
+                value = [self.filter_value(param, field, item) for item in value.split(",")]
+            else:
+                value = self.filter_value(param, field, value)
+            model_field = self.model_field(field.attribute or name)
+            mongo_name = model_field.mongo_name if model_field else (field.attribute or name)
+            conditions.setdefault(mongo_name, {})[FILTER_OPERATORS[operator]] = value
+        if conditions:
+            query = query.raw(conditions)
+        self.check_index(query, requested=bool(conditions) or self.get_sort()[0] != self.default_sort)
+        return query
+
+    def check_index(self, query, requested=True):
+        """
+        reject (or warn about) a list query no declared index serves, the verdict is kept per query shape.
+
+        :param requested: whether the client's filters or sort shaped the query, the resource's own query is served
+        """
+        equality, ranges = indexes.filter_shape(query.raw_query)
+        sort = self.sort_spec()
+        shape = (frozenset(equality), frozenset(ranges), tuple(sort))
+        served = self.index_verdicts.get(shape)
+        if served is None:
+            index = indexes.serving_index(self.service_klass.model_class, equality, ranges, sort)
+            served = self.index_verdicts[shape] = index is not None
+            if not served and (self.unindexed_queries != "reject" or not requested):
+                print("{}: no index serves filtering on {} sorted by {}".format(
+                    type(self).__name__, sorted(equality | ranges), sort))
+        if not served and self.unindexed_queries == "reject" and requested:
+            return abort(409, {"desc": "this combination of filters and sort is not supported"})
+
+    def get_cursor(self):
+        """
+        read the cursor query param, it has to come from a listing in the same order.
+
+        :return: (sort field value, _id) of the object the page starts after, None without a cursor
+        """
+        cursor = request.args.get("cursor")
+        if not cursor:
+            return None
+        sort, attribute, direction = self.get_sort()
+        parse = datetime.fromisoformat if isinstance(self.model_field(attribute), DateTimeField) else None
+        try:
+            return utils.decode_cursor(cursor, field=sort, parse=parse)
+        except ValueError:
+            return abort(409, {"cursor": ["Invalid cursor."]})
+
+    def page_query(self, query, **kwargs):
+        """
+        apply the request's cursor and the keyset ordering over (sort field, _id).
+
+        :param query: the limited query to page through
+        :return: the query, limited to one object more than the page size, and the page size
+        """
+        limit = self.get_limit()
+        sort, attribute, direction = self.get_sort()
+        order = self.sort_spec()
+        field_name = order[0][0]
+        cursor = self.get_cursor()
+        if cursor:
+            value, last_id = cursor
+            operator = "$lt" if direction == pymongo.DESCENDING else "$gt"
+            query = query.raw({"$or": [{field_name: {operator: value}},
+                                       {field_name: value, "_id": {operator: last_id}}]})
+
+        query = query.order_by(order)
+        return query.limit(limit + 1), limit
+
+    def next_cursor(self, obj):
+        """the cursor that resumes the listing after obj"""
+        sort, attribute, direction = self.get_sort()
+        return utils.encode_cursor(utils.get_field(obj, attribute), utils.get_field(obj, "pk"), field=sort)
+
+    def iter_batches(self, query, batch_size=None):
+        """iterate a query in cursor batches, as records when reading raw"""
+        batches = utils.iter_batches(query, batch_size or self.stream_batch_size)
+        if not self.raw_reads:
+            return batches
+        return ([self.raw_reader.to_record(doc) for doc in batch] for batch in batches)
+
+    def paginate(self, query, **kwargs):
+        """
+        keyset pagination over (sort field, _id), see get_sort.
+
+        :param query: the limited query to page through
+        :return: the objects on the requested page and the cursor for the next one (None on the last page)
+        """
+        query, limit = self.page_query(query)
+        page = [obj for batch in self.iter_batches(query, limit + 1) for obj in batch]
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = self.next_cursor(page[-1])
+        return page, next_cursor
+
+    def stream_page(self, query, dumper, **kwargs):
+        """
+        stream a page of the list as JSON, dumping the objects batch by batch as they come off the cursor,
+        so neither the documents nor the response text are ever held whole in memory.
+
+        :param query: the limited query to page through
+        :param dumper: the response serializer
+        :return: a streamed application/json Response with the same envelope as paginate
+        """
+        query, limit = self.page_query(query)
+
+        def generate():
+            yield b'{"data": ['
+            count, last, next_cursor = 0, None, None
+            for batch in self.iter_batches(query):
+                chunk = []
+                with timed("serialization"):
+                    for obj in batch:
+                        if count == limit:
+                            next_cursor = self.next_cursor(last)
+                            break
+                        chunk.append(dumps(dumper.dump(obj)))
+                        count, last = count + 1, obj
+                if chunk:
+                    yield (b"," if count > len(chunk) else b"") + b",".join(chunk)
+            yield b'], "next_cursor": ' + dumps(next_cursor) + b'}\n'
+
+        return Response(stream_with_context(generate()), mimetype="application/json")
+
     def fetch(self, obj_id):
         """
         a helper function that is to be used in on_get requests when only obj_id is provided
@@ -40,7 +380,7 @@ class BaseResource(Resource):
         """
 
         try:
-            obj = self.service_klass.get(obj_id)
+            obj = self.reader.get(obj_id)
         except Exception as e:
             print(e)
             return abort(404, {"desc": "requested object does not exist"})
@@ -56,6 +396,17 @@ class BaseResource(Resource):
         """
         return self.service_klass.create(**data)
 
+    def save_many(self, items, user_context=None, ordered=True):
+        """
+        Saves the validated items of a bulk post.
+
+        :param items: the validated items
+        :param user_context: the user context
+        :param ordered: stop at the first failure
+        :return: (created objects, errors) as returned by the service's create_many
+        """
+        return self.service_klass.create_many(items, ordered=ordered)
+
     def update(self, obj_id, data, user_context=None):
         """
         Saves information sent in by on_post request, where no object id is specified.
@@ -63,9 +414,111 @@ class BaseResource(Resource):
         :param obj_id: the data to be updated.
         :param data: the data to be updated.
         :param user_context: the data to be updated.
-        :return: Object that was created
+        :return: Object that was updated, None if the user has no such object
+        """
+        params = self.write_filter(obj_id)
+        last_updated = self.if_match()
+        if last_updated is None:
+            return self.service_klass.find_and_update(params, **data)
+
+        obj = self.service_klass.find_and_update(dict(params, last_updated=last_updated), **data)
+        if obj is None and self.reader.find_one(params) is not None:
+            return abort(412, {"desc": "If-Match does not match the current version"})
+        return obj
+
+    def list_cache_key(self):
+        """the list cache key of this request, None when the resource doesn't cache lists"""
+        if self.list_cache is None:
+            return None
+        user_context = request.environ.get("user_context") or {}
+        params = tuple(sorted(request.args.items(multi=True)))
+        return self.list_cache.key(type(self).__name__, user_context.get("id"), params)
+
+    def invalidate_lists(self, user_context=None):
+        """called after every write, makes the user's cached list responses unreachable"""
+        if self.list_cache is not None and user_context:
+            self.list_cache.bump(type(self).__name__, user_context.get("id"))
+
+    def get_list(self, dumper):
+        """
+        the list response, served from the list cache when the user's lists haven't been written to since.
+
+        :param dumper: the response serializer
+        """
+        cache_key = self.list_cache_key()
+        cached = self.list_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            body, etag, last_modified = cached
+            not_modified = self.not_modified(etag, last_modified)
+            if not_modified:
+                return not_modified
+            return Response(body, mimetype="application/json", headers=self.validator_headers(etag, last_modified))
+
+        base_query = self.query()
+        limited_query = self.filter_query(self.limit_query(base_query))
+        # a bad page size or cursor fails before the validators' aggregation, and never gets a 304
+        self.get_limit()
+        self.get_cursor()
+        etag, last_modified = self.list_validators(limited_query)
+        not_modified = self.not_modified(etag, last_modified)
+        if not_modified:
+            return not_modified
+        headers = self.validator_headers(etag, last_modified)
+
+        if self.stream_list:
+            resp = self.stream_page(limited_query, dumper)
+            resp.headers.extend(headers)
+            if cache_key is not None:
+                resp.response = self.list_cache.capture(cache_key, resp.response, etag, last_modified)
+            return resp
+        page, next_cursor = self.paginate(limited_query)
+        with timed("serialization"):
+            data = {"data": dumper.dump(page, many=True), "next_cursor": next_cursor}
+            if cache_key is None:
+                return data, 200, headers
+            body = dumps(data)
+        self.list_cache.set(cache_key, body, etag, last_modified)
+        return Response(body, mimetype="application/json", headers=headers)
+
+    def requested_fields(self):
+        """
+        the response fields asked for with ?fields=a,b,c, checked against the response schema.
+
+        :return: sorted tuple of schema field names, None when the parameter is absent
+        """
+        value = request.args.get("fields")
+        if value is None or self.response_serializer is None:
+            return None
+        # compile_schema hands back a plain schema instance for the schemas it can't compile
+        schema = getattr(self.response_serializer, "schema", self.response_serializer)
+        dump_fields = schema.dump_fields
+        names = dict((field.data_key or name, name) for name, field in dump_fields.items())
+        requested = set(name.strip() for name in value.split(",") if name.strip())
+        unknown = sorted(requested - set(names))
+        if unknown or not requested:
+            return abort(409, {"fields": ["unknown field(s): {}, expected some of: {}".format(
+                ", ".join(unknown), ", ".join(sorted(names)))]})
+        return tuple(sorted(names[name] for name in requested))
+
+    def sparse_view(self, fields):
         """
-        return self.service_klass.update(obj_id, **data)
+        the serializer dumping only fields, and the raw reader projecting the documents down to what it and the
+        resource itself need (None when the resource doesn't read raw).
+
+        :return: (dumper, reader)
+        """
+        view = self.sparse_views.get(fields)
+        if view is None:
+            response_schema = self.serializers["response"]
+            reader = None
+            if self.raw_reader is not None:
+                attributes = schema_attributes(response_schema, only=fields)
+                reader = self.service_klass.read_only(
+                    fields=attributes + list(self.raw_read_fields) + list(self.sort_fields))
+            view = compile_schema(response_schema, only=fields), reader
+            if len(self.sparse_views) < self.max_sparse_views:
+                self.sparse_views[fields] = view
+        return view
 
     def get(self, obj_id=None):
         """
@@ -73,16 +526,26 @@ class BaseResource(Resource):
         :return:
         :rtype:
         """
-        schema = self.serializers.get("response")
+        dumper = self.response_serializer
+        fields = self.requested_fields()
+        if fields is not None:
+            dumper, reader = self.sparse_view(fields)
+            if reader is not None:
+                self.raw_reader = reader
 
         if not obj_id:
-            base_query = self.query()
-            limited_query = self.limit_query(base_query)
-            return {"data": schema().dump(limited_query, many=True)}
+            return self.get_list(dumper)
         obj = self.fetch(obj_id)
         if not obj:
             abort(409, {"desc": "requested resource doesn't exist"})
-        return schema().dump(self.limit_get(obj))
+        obj = self.limit_get(obj)
+        etag, last_modified = self.object_validators(obj)
+        not_modified = self.not_modified(etag, last_modified)
+        if not_modified:
+            return not_modified
+        with timed("serialization"):
+            data = dumper.dump(obj)
+        return data, 200, self.validator_headers(etag, last_modified)
 
     def post(self):
         """
@@ -90,18 +553,61 @@ class BaseResource(Resource):
         :return:
         :rtype:
         """
+        if isinstance(request.json, list):
+            return self.post_many(request.json)
         serializer = self.serializers.get("default")
 
         try:
-            validated_data = serializer().load(data=request.json, unknown=EXCLUDE)
+            with timed("validation"):
+                validated_data = serializer().load(data=request.json, unknown=EXCLUDE)
         except ValidationError as e:
 
             return abort(409, e.messages)
         user_context = request.environ.get("user_context")
 
         resp = self.save(data=validated_data, user_context=user_context)
-        resp_serializer = self.serializers.get("response")
-        return resp_serializer().dump(resp)
+        self.invalidate_lists(user_context)
+        with timed("serialization"):
+            return self.response_serializer.dump(resp)
+
+    def post_many(self, items):
+        """
+        create every item of a JSON array body with batched writes. ?ordered=false keeps going past failures,
+        otherwise nothing after the first failing item is attempted.
+
+        :param items: the request body
+        :return: the created objects and per-item errors, {"index": position in the body, "error": ...}
+        """
+        if not self.allow_bulk:
+            return abort(409, {"desc": "this endpoint does not accept a list"})
+        if len(items) > self.max_bulk:
+            return abort(409, {"desc": "at most {} items can be created per request".format(self.max_bulk)})
+        ordered = request.args.get("ordered", "true").lower() != "false"
+        serializer = self.serializers.get("default")()
+
+        valid, positions, errors = [], [], []
+        stop = len(items)
+        with timed("validation"):
+            for index, item in enumerate(items):
+                try:
+                    valid.append(serializer.load(data=item, unknown=EXCLUDE))
+                    positions.append(index)
+                except ValidationError as e:
+                    errors.append({"index": index, "error": e.messages})
+                    if ordered:
+                        stop = index
+                        break
+        user_context = request.environ.get("user_context")
+
+        created, save_errors = self.save_many(valid, user_context=user_context, ordered=ordered)
+        self.invalidate_lists(user_context)
+        errors.extend({"index": positions[error["index"]], "error": error["error"]} for error in save_errors)
+        if ordered:
+            errors.extend({"index": index, "error": "not attempted, an earlier item failed"}
+                          for index in range(stop + 1, len(items)))
+        errors.sort(key=lambda error: error["index"])
+        with timed("serialization"):
+            return {"data": self.response_serializer.dump(created, many=True), "errors": errors}
 
     def put(self, obj_id=None):
         """
@@ -112,18 +618,22 @@ class BaseResource(Resource):
         :rtype:
         """
 
-        self.limit_get(self.fetch(obj_id))
         serializer = self.serializers.get("default")
 
         try:
-            validated_data = serializer().load(data=request.json, unknown=EXCLUDE)
+            with timed("validation"):
+                validated_data = serializer().load(data=request.json, unknown=EXCLUDE)
         except ValidationError as e:
             return abort(409, e.messages)
         user_context = request.environ.get("user_context")
 
         resp = self.update(obj_id=obj_id, data=validated_data, user_context=user_context)
-        resp_serializer = self.serializers.get("response")
-        return resp_serializer().dump(resp)
+        self.invalidate_lists(user_context)
+        if resp is None:
+            return abort(404, {"desc": "requested object does not exist"})
+        with timed("serialization"):
+            data = self.response_serializer.dump(resp)
+        return data, 200, self.validator_headers(*self.object_validators(resp))
 
     def delete(self, obj_id=None):
         """
@@ -134,12 +644,23 @@ class BaseResource(Resource):
         :rtype:
         """
 
-        self.limit_get(self.fetch(obj_id))
-        self.service_klass.update(obj_id, deleted=True)
+        deleted = self.service_klass.find_and_update(self.write_filter(obj_id), deleted=True)
+        self.invalidate_lists(request.environ.get("user_context"))
+        if deleted is None:
+            return abort(404, {"desc": "requested object does not exist"})
         return {"status": "successful"}
 
     @classmethod
     def initiate(cls, serializers=None, service_klass=None):
         cls.serializers = serializers
+        # compiled once here instead of instantiating the schema on every request
+        response_schema = (serializers or {}).get("response")
+        cls.response_serializer = compile_schema(response_schema) if response_schema else None
+        cls.raw_reader = None
+        cls.sparse_views = {}
+        cls.index_verdicts = {}
+        if response_schema and service_klass and hasattr(service_klass, "read_only"):
+            cls.raw_reader = service_klass.read_only(
+                fields=list(schema_attributes(response_schema)) + list(cls.raw_read_fields) + list(cls.sort_fields))
         cls.service_klass = service_klass
         return cls
@@ -0,0 +1,109 @@
+"""
+serializers.py
+
+Compiles marshmallow response schemas into specialized dump functions. marshmallow resolves every field through
+Field.serialize -> get_value -> _serialize on each dump; for the plain field types our response schemas use, the
+compiler generates straight-line python that reads each attribute once and converts it inline. Fields it doesn't know
+are still serialized by marshmallow itself, field by field, and schemas it can't reproduce (dump hooks, a custom
+get_attribute, ordered output) are handed back as a regular schema instance, so the output is always what
+schema().dump() would have produced.
+"""
+
+from functools import partial
+
+from marshmallow import Schema, fields as _fields, missing
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+from marshmallow.utils import ensure_text_type, get_value
+
+# field class -> expression converting a non-None value `v`
+NATIVE_FIELDS = {
+    _fields.String: "v if v.__class__ is str else _text(v)",
+    _fields.Integer: "int(v)",
+    _fields.Float: "float(v)",
+    _fields.Raw: "v",
+}
+
+ISO_FORMATS = (None, "iso", "iso8601")
+
+
+def _native_expression(field):
+    """ The inline conversion for field, or None when marshmallow has to serialize it """
+
+    if field.dump_default is not missing or (field.attribute and "." in field.attribute):
+        return None
+    if type(field) in NATIVE_FIELDS:
+        if isinstance(field, _fields.Number) and field.as_string:
+            return None
+        return NATIVE_FIELDS[type(field)]
+    if type(field) is _fields.DateTime and field.format in ISO_FORMATS:
+        return "v.isoformat()"
+    return None
+
+
+class CompiledSerializer(object):
+    """ Drop-in for a marshmallow schema instance when only dump() is needed """
+
+    def __init__(self, schema, dump_one, source):
+        self.schema = schema
+        self.dump_one = dump_one
+        self.source = source
+
+    def dump(self, obj, many=None):
+        many = self.schema.many if many is None else bool(many)
+        if many and obj is not None:
+            dump_one = self.dump_one
+            return [dump_one(item) for item in obj]
+        return self.dump_one(obj)
+
+
+def compile_schema(schema_class, **kwargs):
+    """
+    Turn a marshmallow schema into a specialized dump function.
+
+    :param schema_class: the marshmallow Schema class (kwargs such as only= are passed to its constructor)
+    :return: a CompiledSerializer, or a plain schema instance when the schema can't be compiled. Both expose
+        dump(obj, many=None).
+    """
+    schema = schema_class(**kwargs)
+    if (schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP)
+            or type(schema).get_attribute is not Schema.get_attribute or schema.dict_class is not dict):
+        return schema
+
+    attributes = [field.attribute or name for name, field in schema.dump_fields.items()]
+    # dict.get only matches marshmallow's lookup when no key collides with a dict attribute
+    dict_get = not any(hasattr(dict, attribute) for attribute in attributes)
+
+    namespace = {"_missing": missing, "_text": ensure_text_type, "_get_value": get_value, "_partial": partial,
+                 "_getattr": getattr}
+    lines = ["def dump(obj):",
+             "    if obj.__class__ is dict and %s:" % dict_get,
+             "        g = obj.get",
+             "    elif hasattr(obj, '__getitem__'):",
+             "        g = _partial(_get_value, obj)",
+             "    else:",
+             "        g = _partial(_getattr, obj)",
+             "    out = {}"]
+    for index, (name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else name
+        expression = _native_expression(field)
+        if expression is None:
+            namespace["_field_%d" % index] = field
+            lines += ["    v = _field_%d.serialize(%r, obj, accessor=_get_attribute)" % (index, name),
+                      "    if v is not _missing:",
+                      "        out[%r] = v" % key]
+            continue
+        lines += ["    v = g(%r, _missing)" % (field.attribute or name),
+                  "    if v is not _missing:",
+                  "        out[%r] = None if v is None else %s" % (key, expression)]
+    lines.append("    return out")
+
+    namespace["_get_attribute"] = schema.get_attribute
+    source = "\n".join(lines)
+    exec(compile(source, "<compiled %s>" % schema_class.__name__, "exec"), namespace)
+    return CompiledSerializer(schema, namespace["dump"], source)
+
+
+def schema_attributes(schema_class, **kwargs):
+    """ The object attributes a schema reads when dumping, e.g. to build a projection (kwargs such as only=) """
+
+    return [field.attribute or name for name, field in schema_class(**kwargs).dump_fields.items()]
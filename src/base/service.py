@@ -21,6 +21,68 @@ overridden. Functionality for each service class include:
 from datetime import datetime
 from ..base import utils
 from bson.objectid import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymodm.errors import ValidationError
+
+
+class RawReader(object):
+    """
+    Read-only access to a service's collection that skips model hydration. Documents come back as plain dicts,
+    projected to the requested fields, with _id renamed to pk (and any other mongo names to their attribute names).
+    """
+
+    def __init__(self, service, fields=None):
+        self.service = service
+        self.model_class = service.model_class
+        self.renames = {"_id": "pk"}
+        self.projection = None
+
+        if fields is not None:
+            meta = self.model_class._mongometa
+            self.projection = ["_id"]
+            for name in fields:
+                field = meta.get_field_from_attname(name)
+                if field is None or field.mongo_name in self.projection:
+                    continue
+                self.projection.append(field.mongo_name)
+                if field.mongo_name != name:
+                    self.renames[field.mongo_name] = name
+
+    @property
+    def objects(self):
+        """ QuerySet of raw documents, chain raw()/order_by()/limit() on it as usual """
+        queryset = self.model_class.objects.values()
+        if self.projection:
+            queryset = queryset.only(*self.projection)
+        return queryset
+
+    def to_record(self, doc):
+        """ Rename mongo keys to the attribute names the response schemas read """
+        for mongo_name, name in self.renames.items():
+            if mongo_name in doc:
+                doc[name] = doc.pop(mongo_name)
+        return doc
+
+    def _first(self, params):
+        if self.service.object_cache is None:
+            return self.objects.raw(params).first()
+        # the object cache holds whole documents, project them here
+        doc = self.service.find_document(params)
+        if self.projection:
+            doc = dict((name, doc[name]) for name in self.projection if name in doc)
+        return doc
+
+    def get(self, obj_id):
+        """ Get a single document by id, raises the model's DoesNotExist like the service's get """
+        return self.to_record(self._first({"_id": self.service._prepare_id(obj_id)}))
+
+    def find_one(self, params):
+        """ Find a single document that matches params, None if there is none """
+        try:
+            return self.to_record(self._first(params))
+        except self.model_class.DoesNotExist:
+            return None
 
 
 class ServiceFactory(object):
@@ -29,12 +91,18 @@ class ServiceFactory(object):
     """
 
     @classmethod
-    def create_service(cls, klass):
-        """ create and generate a service class using the parameters above """
+    def create_service(cls, klass, cache=None):
+        """
+        create and generate a service class using the parameters above
+
+        :param klass: the model class
+        :param cache: optional ObjectCache, opts the model into read-through caching of get/find_one by _id
+        """
 
         class BaseService:
             model_class = klass
             objects = klass.objects
+            object_cache = cache
 
             @classmethod
             def _prepare_id(cls, obj_id):
@@ -44,6 +112,39 @@ class ServiceFactory(object):
 
                 return obj_id
 
+            @classmethod
+            def read_only(cls, fields=None):
+                """ Raw, read-only view of the collection returning dicts projected to fields (attribute names) """
+
+                return RawReader(cls, fields=fields)
+
+            @classmethod
+            def find_document(cls, params):
+                """
+                Raw document matching params, read through the object cache. Lookups by _id (plus plain equality
+                conditions) are answered from the cache when possible, everything that comes from mongo is cached.
+
+                :raises: the model's DoesNotExist when nothing matches
+                """
+
+                if cls.object_cache is not None and "_id" in params and \
+                        not any(key.startswith("$") or isinstance(value, dict) for key, value in params.items()):
+                    doc = cls.object_cache.get(cls.model_class, params["_id"])
+                    if doc is not None and all(doc.get(key) == value for key, value in params.items()):
+                        return doc
+
+                doc = cls.model_class.objects.raw(params).values().first()
+                if cls.object_cache is not None:
+                    cls.object_cache.set(cls.model_class, doc)
+                return doc
+
+            @classmethod
+            def invalidate(cls, *obj_ids):
+                """ Drop the given objects from the object cache, called after every write """
+
+                if cls.object_cache is not None:
+                    cls.object_cache.invalidate(cls.model_class, *obj_ids)
+
             @classmethod
             def get(cls, obj_id):
                 """ Get a single object from the database collection """
@@ -53,6 +154,8 @@ class ServiceFactory(object):
 
                 _obj_id = obj_id
                 obj_id = cls._prepare_id(obj_id)
+                if cls.object_cache is not None:
+                    return cls.model_class.from_document(cls.find_document({"_id": obj_id}))
                 obj = cls.model_class.objects.get({"_id": obj_id})
                 return obj
 
@@ -61,6 +164,8 @@ class ServiceFactory(object):
                 """ Find a single object that matches the criteria within the parameters """
 
                 try:
+                    if cls.object_cache is not None:
+                        return cls.model_class.from_document(cls.find_document(params))
                     obj = cls.model_class.objects.get(params)
                     return obj
                 except klass.DoesNotExist:
@@ -90,23 +195,161 @@ class ServiceFactory(object):
                     raise
 
             @classmethod
-            def update(cls, obj_id, ignored_args=None, **kwargs):
-                """ Update an existing record. if obj_id isn't an instance of ObjectId it will first be converted """
+            def create_many(cls, items, ordered=True, ignored_args=None):
+                """
+                Create many objects with batched inserts instead of one journaled round trip each.
+
+                :param items: list of dicts, one per object
+                :param ordered: stop at the first failure (True) or insert everything that can be inserted (False)
+                :return: (created objects, errors) where each error is {"index": position in items, "error": message}
+                """
 
                 if not ignored_args:
                     ignored_args = ["_id", "date_created", "last_updated", "pk"]
 
-                obj = cls.get(obj_id)
-                data = utils.clean_kwargs(ignored_args, kwargs)
-                obj = utils.populate_obj(obj, data)
+                objs, positions, errors = [], [], []
+                # with ordered, nothing after this index is attempted
+                stop = len(items)
+                for index, kwargs in enumerate(items):
+                    obj = utils.populate_obj(cls.model_class(), utils.clean_kwargs(ignored_args, dict(kwargs)))
+                    try:
+                        obj.full_clean()
+                    except ValidationError as e:
+                        errors.append({"index": index, "error": str(e)})
+                        if ordered:
+                            stop = index
+                            break
+                        continue
+                    objs.append(obj)
+                    positions.append(index)
+
+                docs = [obj.to_son() for obj in objs]
+                failed = {}
+                if docs:
+                    try:
+                        cls.model_class._mongometa.collection.insert_many(docs, ordered=ordered)
+                    except BulkWriteError as e:
+                        failed = dict((error["index"], error["errmsg"]) for error in e.details["writeErrors"])
+                        if ordered:
+                            stop = positions[min(failed)]
+
+                created = []
+                for position, (obj, doc) in enumerate(zip(objs, docs)):
+                    if position in failed:
+                        errors.append({"index": positions[position], "error": failed[position]})
+                    elif positions[position] < stop:
+                        obj.pk = doc["_id"]
+                        created.append(obj)
+                if ordered:
+                    errors.extend({"index": index, "error": "not attempted, an earlier item failed"}
+                                  for index in range(stop + 1, len(items)))
+                errors.sort(key=lambda error: error["index"])
+                return created, errors
+
+            @classmethod
+            def _changes(cls, data):
+                """ Turn attribute -> value pairs into a $set document of mongo names -> mongo values """
+
+                meta = cls.model_class._mongometa
+                changes = {}
+                for name, value in data.items():
+                    field = meta.get_field_from_attname(name)
+                    if field is None:
+                        continue
+                    if isinstance(value, float):
+                        value = utils.roundUp(value)
+                    changes[field.mongo_name] = field.to_mongo(value) if value is not None else None
+                return changes
+
+            @classmethod
+            def find_and_update(cls, params, ignored_args=None, **kwargs):
+                """
+                Atomically $set the given fields (and last_updated) on the object matching params, in one
+                find_one_and_update. Put every condition the write depends on (ownership, soft deletion) in params.
+
+                :return: the updated object, or None when nothing matches params
+                """
+
+                if not ignored_args:
+                    ignored_args = ["_id", "date_created", "last_updated", "pk"]
+
+                changes = cls._changes(utils.clean_kwargs(ignored_args, kwargs))
                 if "last_updated" in ignored_args:
-                    obj.last_updated = datetime.utcnow()
+                    changes["last_updated"] = datetime.utcnow()
                 try:
-                    obj = obj.save()
-                    return obj
+                    query = cls.model_class.objects.raw(params)
+                    # e.g. maxTimeMS, when the model's queryset bounds its operations
+                    options = query.operation_options() if hasattr(query, "operation_options") else {}
+                    doc = cls.model_class._mongometa.collection.find_one_and_update(
+                        query.raw_query, {"$set": changes}, return_document=ReturnDocument.AFTER, **options)
                 except Exception as e:
                     print(e)
                     raise
+                if doc is None:
+                    return None
+                cls.invalidate(doc["_id"])
+                return cls.model_class.from_document(doc)
+
+            @classmethod
+            def update(cls, obj_id, ignored_args=None, **kwargs):
+                """ Update an existing record. if obj_id isn't an instance of ObjectId it will first be converted """
+
+                if isinstance(obj_id, cls.model_class):
+                    obj_id = obj_id.pk
+
+                obj = cls.find_and_update({"_id": cls._prepare_id(obj_id)}, ignored_args=ignored_args, **kwargs)
+                if obj is None:
+                    raise cls.model_class.DoesNotExist()
+                return obj
+
+            @classmethod
+            def update_many(cls, updates, ordered=True, ignored_args=None):
+                """
+                Apply many partial updates in one bulk write. Only the given fields (and last_updated) are set.
+
+                :param updates: list of (obj_id, dict of changes) pairs
+                :param ordered: stop at the first failure (True) or apply everything that can be applied (False)
+                :return: (number of matched objects, errors) where each error is {"index": position, "error": message}
+                """
+
+                if not ignored_args:
+                    ignored_args = ["_id", "date_created", "last_updated", "pk"]
+
+                meta = cls.model_class._mongometa
+                obj_ids, operations = [], []
+                for obj_id, kwargs in updates:
+                    changes = cls._changes(utils.clean_kwargs(ignored_args, dict(kwargs)))
+                    changes["last_updated"] = datetime.utcnow()
+                    obj_ids.append(cls._prepare_id(obj_id))
+                    operations.append(UpdateOne({"_id": obj_ids[-1]}, {"$set": changes}))
+
+                if not operations:
+                    return 0, []
+                try:
+                    result = meta.collection.bulk_write(operations, ordered=ordered)
+                    return result.matched_count, []
+                except BulkWriteError as e:
+                    errors = [{"index": error["index"], "error": error["errmsg"]} for error in e.details["writeErrors"]]
+                    return e.details["nMatched"], errors
+                finally:
+                    cls.invalidate(*obj_ids)
+
+            @classmethod
+            def get_by_ids(cls, obj_ids):
+                """ Get the objects with the given ids in one query, in the order of obj_ids (missing ids are skipped) """
+
+                obj_ids = [cls._prepare_id(obj_id) for obj_id in obj_ids]
+                found = dict((obj.pk, obj) for obj in cls.model_class.objects.raw({"_id": {"$in": obj_ids}}))
+                return [found[obj_id] for obj_id in obj_ids if obj_id in found]
+
+            @classmethod
+            def delete_by_ids(cls, obj_ids):
+                """ Delete the objects with the given ids in one statement, returns the number deleted """
+
+                obj_ids = [cls._prepare_id(obj_id) for obj_id in obj_ids]
+                deleted = cls.model_class._mongometa.collection.delete_many({"_id": {"$in": obj_ids}}).deleted_count
+                cls.invalidate(*obj_ids)
+                return deleted
 
             @classmethod
             def delete(cls, obj_id):
@@ -116,6 +359,7 @@ class ServiceFactory(object):
 
                 try:
                     obj.delete()
+                    cls.invalidate(obj.pk)
                     return obj
                 except Exception as e:
                     print(e)
@@ -10,15 +10,19 @@ This module contains a number of utility functions useful throughout our applica
 No references are made to specific models or resources. As a result, they are useful with or
 without the application context.
 """
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from math import ceil
 
 from bson.objectid import ObjectId
+import base64
 import json
+import re
 from marshmallow import ValidationError, EXCLUDE
 from pymodm import MongoModel, EmbeddedMongoModel
 from pymodm.queryset import QuerySet
 
+from src.base import encoding
+
 
 class CustomJSONEncoder(json.JSONEncoder):
     """ JSON encoder that supports date formats """
@@ -65,12 +69,33 @@ def marshal(resp, schema):
     return resp_
 
 
+def iter_batches(queryset, batch_size=100):
+    """
+    Iterates a pymodm QuerySet batch_size documents at a time
+
+    param queryset: the QuerySet to read
+    param batch_size: documents requested from mongo per round trip, and per yielded list
+
+    returns: generator of lists of model instances (or dicts for a .values() QuerySet)
+    """
+    cursor = queryset._get_raw_cursor().batch_size(batch_size)
+    to_instance = (lambda doc: doc) if queryset._return_raw else queryset._model.from_document
+    batch = []
+    for doc in cursor:
+        batch.append(to_instance(doc))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def convert_dict(data, indent=None, to_json=False):
-    json_str = json.dumps(data, indent=indent, cls=CustomJSONEncoder)
     if to_json:
-        # json_str = json_str.rstrip("'").lstrip("'")
-        json_str = json.loads(json_str)
-    return json_str
+        return encoding.to_primitive(data)
+    if indent:
+        return json.dumps(data, indent=indent, cls=CustomJSONEncoder)
+    return encoding.dumps(data).decode("utf-8")
 
 
 def clean_kwargs(ignored_keys, data):
@@ -113,3 +138,98 @@ def populate_obj(obj, data):
             setattr(obj, name, value)
 
     return obj
+
+
+def get_field(obj, name, default=None):
+    """
+    Reads a field off a model instance or a raw record (dict)
+    """
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_millis(value):
+    """
+    Naive UTC datetime to integer milliseconds since the epoch, the precision mongo stores dates with
+    """
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def from_millis(value):
+    """
+    Reverses to_millis
+    """
+    return EPOCH + timedelta(milliseconds=int(value))
+
+
+def encode_cursor(value, obj_id, field="-date_created"):
+    """
+    Builds an opaque pagination cursor from the sort keys of the last object on a page
+
+    param value: value of the sort field on the last object returned
+    param obj_id: _id of the last object returned
+    param field: the ordering, e.g. -date_created, so a cursor can't be replayed against another one
+
+    returns: url safe cursor string
+    """
+    payload = [value.isoformat() if isinstance(value, datetime) else value, str(obj_id)]
+    if field != "-date_created":
+        payload.append(field)
+    payload = json.dumps(payload, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, field="-date_created", parse=datetime.fromisoformat):
+    """
+    Reverses encode_cursor
+
+    param cursor: cursor string sent in by the client
+    param field: the ordering the cursor must have been built for
+    param parse: converts the encoded sort value back, None to keep it as decoded
+
+    returns: (value, ObjectId) tuple
+    raises: ValueError if the cursor is malformed or was built for another ordering
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value, obj_id = payload[:2]
+        cursor_field = payload[2] if len(payload) > 2 else "-date_created"
+        if cursor_field != field:
+            raise ValueError("the cursor is for the sort={} ordering".format(cursor_field))
+        return (parse(value) if parse else value), ObjectId(obj_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor: {}".format(e))
+
+
+def search_terms(text):
+    """
+    The words of a $text search string that documents match on, negated (-word) ones left out
+    """
+    return [term for term in re.findall(r"-?\w+", text) if not term.startswith("-")]
+
+
+def snippet(text, terms, width=160):
+    """
+    Cuts the part of text around the first occurrence of any of terms, whitespace collapsed
+
+    param text: the text to cut from
+    param terms: the words searched for, the start of text is used when none occurs (e.g. only a stem matched)
+    param width: characters to keep at most
+
+    returns: the excerpt, with ellipses where text was cut
+    """
+    if not text:
+        return ""
+    lowered = text.lower()
+    positions = [position for position in (lowered.find(term.lower()) for term in terms if term) if position >= 0]
+    start = max(0, min(positions) - width // 4) if positions else 0
+    end = min(len(text), start + width)
+    start = max(0, end - width)
+    excerpt = " ".join(text[start:end].split())
+    return ("..." if start > 0 else "") + excerpt + ("..." if end < len(text) else "")
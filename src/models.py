@@ -1,7 +1,7 @@
 """
 models.py
 
-Data model file for application. This will connect to the mongo database and provide a source for storage
+Data model file for application. connect_db connects to the mongo database, the models provide a source for storage
 for the application service
 
 """
@@ -12,14 +12,61 @@ import pymongo
 from pymongo.write_concern import WriteConcern
 from pymongo.operations import IndexModel
 from pymodm import connect, fields, MongoModel, EmbeddedMongoModel
+from pymodm.manager import Manager
+from pymodm.queryset import QuerySet
 from datetime import datetime, timedelta
-import bcrypt
-import json
+from src.base.encoding import to_primitive
+from src.base.hashing import PasswordHasher
+from src.base.metrics import CommandTimer
+from src.base.querylog import QueryMonitor
+from src.base.pool import pool_monitor
 import jwt
 
-# Must always be run before any other database calls can follow
 
-connect(settings.MONGO_DB_URI, connect=False, maxPoolSize=None)
+def connect_db(**kwargs):
+    """
+    Register the mongo client behind the models. Must run before any other database call, in the process that
+    makes them: under gunicorn that is every worker after the fork (see gunicorn.conf.py), never a process that
+    forks afterwards, so no worker inherits its parent's client.
+
+    :param kwargs: extra MongoClient options
+    """
+    options = dict(maxPoolSize=settings.MONGO_MAX_POOL_SIZE, minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                   waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                   maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+                   serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS)
+    options.update(kwargs)
+    connect(settings.MONGO_DB_URI, connect=False,
+            event_listeners=[CommandTimer(), pool_monitor,
+                             QueryMonitor(slow_ms=settings.MONGO_SLOW_QUERY_MS,
+                                          explain=settings.MONGO_SLOW_QUERY_EXPLAIN,
+                                          budget=settings.MONGO_QUERY_BUDGET)], **options)
+
+
+class BoundedQuerySet(QuerySet):
+    """ QuerySet whose finds and aggregations are aborted by the server after MONGO_MAX_TIME_MS """
+
+    def operation_options(self):
+        """ keyword arguments bounding a single pymongo read or findAndModify the same way """
+        return {"maxTimeMS": settings.MONGO_MAX_TIME_MS} if settings.MONGO_MAX_TIME_MS else {}
+
+    def _get_raw_cursor(self):
+        cursor = super(BoundedQuerySet, self)._get_raw_cursor()
+        if settings.MONGO_MAX_TIME_MS:
+            cursor = cursor.max_time_ms(settings.MONGO_MAX_TIME_MS)
+        return cursor
+
+    def aggregate(self, *pipeline, **kwargs):
+        for key, value in self.operation_options().items():
+            kwargs.setdefault(key, value)
+        return super(BoundedQuerySet, self).aggregate(*pipeline, **kwargs)
+
+
+BoundedManager = Manager.from_queryset(BoundedQuerySet)
+
+
+password_hasher = PasswordHasher(rounds=settings.PASSWORD_HASH_ROUNDS, executor=settings.PASSWORD_HASH_EXECUTOR,
+                                 workers=settings.PASSWORD_HASH_WORKERS, max_pending=settings.PASSWORD_HASH_MAX_PENDING)
 
 
 class AppMixin:
@@ -33,9 +80,9 @@ class AppMixin:
         @return:
         """
         if isinstance(self, (MongoModel, EmbeddedMongoModel)):
-            d = self.to_custom_son(exclude=exclude).to_dict()
-            # [d.pop(i, None) for i in exclude]
-            return json.loads(json.dumps(d, default=str)) if do_dump else d
+            d = self.to_son().to_dict()
+            [d.pop(i, None) for i in exclude or ()]
+            return to_primitive(d) if do_dump else d
         return self.__dict__
 
 
@@ -51,6 +98,8 @@ class User(MongoModel, AppMixin):
     date_created = fields.DateTimeField(required=True, blank=False, default=datetime.utcnow)
     last_updated = fields.DateTimeField(required=True, blank=False, default=datetime.utcnow)
 
+    objects = BoundedManager()
+
     class Meta:
         """
         Meta class
@@ -58,9 +107,29 @@ class User(MongoModel, AppMixin):
 
         write_concern = WriteConcern(j=True)
         ignore_unknown_fields = True
+        # no subclasses: pymodm neither stores _cls nor adds it to every query, which no index would cover
+        final = True
         indexes = [
-            IndexModel([("_cls", pymongo.DESCENDING), ("email", pymongo.ASCENDING), ("first_name", pymongo.ASCENDING),
-                        ("last_name", pymongo.ASCENDING), ("date_created", pymongo.DESCENDING), ])]
+            # login looks users up by email alone, uniqueness is what rejects duplicate registrations
+            IndexModel([("email", pymongo.ASCENDING)], name="email", unique=True)]
+
+    @staticmethod
+    def make_password(password):
+        """
+        Hash a clear text password without touching any user.
+        Lets a new user be inserted with its password in a single write.
+
+        Arguments:
+            password {str or bytes} -- The password, in clear text, to be hashed
+
+        Returns:
+            str -- the bcrypt hash
+        """
+
+        if not password or not isinstance(password, (str, bytes)):
+            raise ValueError("Password must be non-empty string or bytes value")
+
+        return password_hasher.hash(password)
 
     def set_password(self, password):
         """
@@ -71,14 +140,16 @@ class User(MongoModel, AppMixin):
             password {str or unidecode} -- The password, in clear text, to be hashed and set on the model
         """
 
-        if not password or not isinstance(password, (str, bytes)):
-            raise ValueError("Password must be non-empty string or bytes value")
-
-        self.password = (bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())).decode()
+        self.password = self.make_password(password)
         # set last updated.
         self.last_updated = datetime.utcnow()
 
-        return self.save()
+        if self.pk is None:
+            return self.save()
+        # only touch the password fields, the instance may have been loaded with a projection
+        self._mongometa.collection.update_one(
+            {"_id": self.pk}, {"$set": {"password": self.password, "last_updated": self.last_updated}})
+        return self
 
     def check_password(self, password):
         """
@@ -90,6 +161,7 @@ class User(MongoModel, AppMixin):
 
         Raises:
             ValueError -- Raised if there is an empty value in password
+            HasherBusy -- Raised if the hashing queue is full
 
         Returns:
             bool -- True if password is equal to hashed password, False if not.
@@ -98,8 +170,13 @@ class User(MongoModel, AppMixin):
         if not password or not isinstance(password, (str, bytes)):
             raise ValueError("Password must be non-empty string or bytes value")
 
-        # both password and hashed password need to be encrypted.
-        return bcrypt.checkpw(password.encode('utf-8'), self.password.encode('utf-8'))
+        return password_hasher.verify(password, self.password)
+
+    @property
+    def password_needs_rehash(self):
+        """ True when the stored hash was made with a different work factor than the configured one """
+
+        return password_hasher.needs_rehash(self.password)
 
     @property
     def auth_token(self):
@@ -129,6 +206,8 @@ class Template(MongoModel, AppMixin):
     date_created = fields.DateTimeField(required=True, blank=False, default=datetime.utcnow)
     last_updated = fields.DateTimeField(required=True, blank=False, default=datetime.utcnow)
 
+    objects = BoundedManager()
+
     class Meta:
         """
         Meta class
@@ -136,6 +215,22 @@ class Template(MongoModel, AppMixin):
 
         write_concern = WriteConcern(j=True)
         ignore_unknown_fields = True
+        # no subclasses: pymodm neither stores _cls nor adds it to every query, which no index would cover
+        final = True
         indexes = [
-            IndexModel([("_cls", pymongo.DESCENDING), ("deleted", pymongo.ASCENDING), ("subject", pymongo.ASCENDING),
-                        ("date_created", pymongo.DESCENDING), ])]
+            # serves the paginated list query {"user_id": ..., "deleted": False} sorted by (date_created, _id)
+            IndexModel([("user_id", pymongo.ASCENDING), ("deleted", pymongo.ASCENDING),
+                        ("date_created", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+                       name="user_id_deleted_date_created"),
+            # ?sort=(-)last_updated, optionally with a last_updated range
+            IndexModel([("user_id", pymongo.ASCENDING), ("deleted", pymongo.ASCENDING),
+                        ("last_updated", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+                       name="user_id_deleted_last_updated"),
+            # ?subject= in the default ordering, date_created ranges included
+            IndexModel([("user_id", pymongo.ASCENDING), ("deleted", pymongo.ASCENDING), ("subject", pymongo.ASCENDING),
+                        ("date_created", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+                       name="user_id_deleted_subject_date_created"),
+            # GET /template/search, the text index is prefixed with the equality scope every search is made in
+            IndexModel([("user_id", pymongo.ASCENDING), ("deleted", pymongo.ASCENDING), ("name", pymongo.TEXT),
+                        ("subject", pymongo.TEXT), ("body", pymongo.TEXT)],
+                       weights={"name": 10, "subject": 5, "body": 1}, name="user_id_deleted_text")]
@@ -1,7 +1,9 @@
 from flask import make_response, abort
+from pymongo.errors import DuplicateKeyError
 
 from src.schema import RegistrationSchema, UserResponseSchema, LoginSchema, LoginResponseSchema
 from src.base.resource import BaseResource
+from src.base.hashing import HasherBusy
 
 
 class RegisterResource(BaseResource):
@@ -25,7 +27,12 @@ class RegisterResource(BaseResource):
         :return:
         :rtype:
         """
-        return self.service_klass.register_account(**data)
+        try:
+            return self.service_klass.register_account(**data)
+        except DuplicateKeyError:
+            abort(409, {"email": ["An account with this email already exists"]})
+        except HasherBusy:
+            abort(503, {"err": "server busy, try again shortly"})
 
 
 class LoginResource(BaseResource):
@@ -48,8 +55,16 @@ class LoginResource(BaseResource):
         :rtype:
         """
         email = data.get("email")
-        user = self.service_klass.find_one({"email": email})
+        password = data.get("password")
+        user = data.get("user") or self.service_klass.find_one({"email": email})
+        if not user:
+            abort(409, {"email": ["Invalid email"]})
 
-        if not user.check_password(data.get("password")):
-            abort(409, {"err": "invalid password supplied"})
+        try:
+            if not user.check_password(password):
+                abort(409, {"err": "invalid password supplied"})
+            if user.password_needs_rehash:
+                user.set_password(password)
+        except HasherBusy:
+            abort(503, {"err": "server busy, try again shortly"})
         return user
@@ -1,8 +1,16 @@
 from bson import ObjectId
-from flask import abort
+from flask import abort, request, Response, stream_with_context
+from marshmallow import EXCLUDE, ValidationError
 
+import settings
+from src.base.cache import ListCache
+from src.base import utils
+from src.base.metrics import timed
+from src.base.rendering import RenderError
 from src.base.resource import BaseResource
-from src.schema import TemplateSchema, TemplateResponseSchema
+from src.base.serializers import compile_schema
+from src.schema import TemplateSchema, TemplateResponseSchema, RenderSchema, RenderResponseSchema, \
+    TemplateSearchResultSchema, TemplateSnippetSchema
 
 
 class TemplateResource(BaseResource):
@@ -14,6 +22,19 @@ class TemplateResource(BaseResource):
         "default": TemplateSchema,
         "response": TemplateResponseSchema
     }
+    raw_reads = True
+    allow_bulk = True
+    # each combination has to be served by one of Template.Meta.indexes
+    filter_fields = {
+        "subject": ("eq", "in"),
+        "date_created": ("gt", "gte", "lt", "lte"),
+        "last_updated": ("gt", "gte", "lt", "lte"),
+    }
+    sort_fields = ("date_created", "last_updated")
+    # every filter and sort above has an index in Template's Meta.indexes, anything else is a mistake
+    unindexed_queries = "reject"
+    list_cache = ListCache(maxsize=settings.LIST_CACHE_SIZE, ttl=settings.LIST_CACHE_TTL,
+                           max_entry_bytes=settings.LIST_CACHE_MAX_ENTRY_BYTES) if settings.LIST_CACHE_TTL > 0 else None
 
     def query(self):
         """
@@ -21,7 +42,7 @@ class TemplateResource(BaseResource):
         :return:
         :rtype:
         """
-        return self.service_klass.objects.raw({"deleted": False})
+        return self.reader.objects.raw({"deleted": False})
 
     def fetch(self, obj_id):
         """
@@ -31,7 +52,7 @@ class TemplateResource(BaseResource):
         :return:
         :rtype:
         """
-        obj = self.service_klass.find_one({"_id": ObjectId(obj_id), "deleted": False})
+        obj = self.reader.find_one({"_id": ObjectId(obj_id), "deleted": False})
         return obj
 
     def save(self, data, user_context=None):
@@ -44,6 +65,224 @@ class TemplateResource(BaseResource):
         :return:
         :rtype:
         """
+        return self.service_klass.create(**self.prepare(data, user_context))
+
+    def save_many(self, items, user_context=None, ordered=True):
+        """
+
+        :param items:
+        :type items:
+        :param user_context:
+        :type user_context:
+        :param ordered:
+        :type ordered:
+        :return:
+        :rtype:
+        """
+        items = [self.prepare(data, user_context) for data in items]
+        return self.service_klass.create_many(items, ordered=ordered)
+
+    def write_filter(self, obj_id, **kwargs):
+        """
+
+        :param obj_id:
+        :type obj_id:
+        :return:
+        :rtype:
+        """
+        params = super(TemplateResource, self).write_filter(obj_id)
+        params["deleted"] = False
+        return params
+
+    def update(self, obj_id, data, user_context=None):
+        """
+
+        :param obj_id:
+        :type obj_id:
+        :param data:
+        :type data:
+        :param user_context:
+        :type user_context:
+        :return:
+        :rtype:
+        """
+        data["name"] = data.pop("template_name")
+        return super(TemplateResource, self).update(obj_id, data, user_context=user_context)
+
+    def prepare(self, data, user_context):
+        """map the validated payload onto the model's fields"""
         data["user_id"] = user_context.get("id")
         data["name"] = data.pop("template_name")
-        return self.service_klass.create(**data)
+        return data
+
+
+class TemplateRenderResource(TemplateResource):
+    """
+    POST /template/<obj_id>/render: the template's subject and body rendered with {"context": {...}}
+    """
+
+    serializers = {
+        "default": RenderSchema,
+        "response": RenderResponseSchema
+    }
+    list_cache = None
+
+    def get(self, obj_id=None):
+        abort(400)
+
+    def put(self, obj_id=None):
+        abort(400)
+
+    def delete(self, obj_id=None):
+        abort(400)
+
+    def post(self, obj_id=None):
+        """
+
+        :param obj_id:
+        :type obj_id:
+        :return:
+        :rtype:
+        """
+        try:
+            with timed("validation"):
+                data = self.serializers.get("default")().load(data=request.json or {}, unknown=EXCLUDE)
+        except ValidationError as e:
+            return abort(409, e.messages)
+
+        obj = self.fetch(obj_id)
+        if not obj:
+            return abort(404, {"desc": "requested object does not exist"})
+        obj = self.limit_get(obj)
+        try:
+            with timed("rendering"):
+                rendered = self.service_klass.render(obj, data["context"])
+        except RenderError as e:
+            return abort(409, {"desc": str(e)})
+        with timed("serialization"):
+            return self.response_serializer.dump(dict(rendered, pk=utils.get_field(obj, "pk")))
+
+
+class TemplateMergeResource(TemplateRenderResource):
+    """
+    POST /template/<obj_id>/merge: the template rendered for every recipient context of an NDJSON upload, streamed back
+    as NDJSON in upload order, {"row", "subject", "body"} or {"row", "error"} per line. ?batch_size= sets the rows
+    rendered per chunk.
+    """
+
+    content_types = ("application/x-ndjson", "application/jsonl")
+
+    def get_batch_size(self):
+        """read the chunk size from the batch_size query param, capped at MERGE_MAX_BATCH_SIZE"""
+        batch_size = request.args.get("batch_size", settings.MERGE_BATCH_SIZE)
+        try:
+            batch_size = int(batch_size)
+        except (TypeError, ValueError):
+            return abort(409, {"batch_size": ["Not a valid integer."]})
+        if batch_size < 1:
+            return abort(409, {"batch_size": ["Must be greater than or equal to 1."]})
+        return min(batch_size, settings.MERGE_MAX_BATCH_SIZE)
+
+    def post(self, obj_id=None):
+        """
+
+        :param obj_id:
+        :type obj_id:
+        :return:
+        :rtype:
+        """
+        if request.mimetype not in self.content_types:
+            return abort(415, {"desc": "send the recipient contexts as {}".format(" or ".join(self.content_types))})
+        batch_size = self.get_batch_size()
+
+        obj = self.fetch(obj_id)
+        if not obj:
+            return abort(404, {"desc": "requested object does not exist"})
+        obj = self.limit_get(obj)
+        try:
+            # read lazily, the upload is consumed as the rendered rows are sent
+            rows = self.service_klass.render_batch(obj, request.stream, batch_size=batch_size)
+        except RenderError as e:
+            return abort(409, {"desc": str(e)})
+        return Response(stream_with_context(rows), mimetype="application/x-ndjson")
+
+
+class TemplateSearchResource(TemplateResource):
+    """
+    GET /template/search?q=...: the user's templates matching q through the text index, best matches first. Hits carry
+    their score and a snippet of the body instead of the body itself, ?snippets=false returns the whole templates.
+    Pages are {"data": [...], "next_cursor": ...} like the list's.
+    """
+
+    serializers = {
+        "default": TemplateSchema,
+        "response": TemplateSearchResultSchema,
+        "snippet": TemplateSnippetSchema
+    }
+    list_cache = None
+    max_query_length = 256
+    # text matches can't be paged by key, the cursor is an offset and paging stops after this many results
+    max_results = 1000
+    snippet_width = 160
+
+    def search_query(self):
+        """read and check the q query param"""
+        text = (request.args.get("q") or "").strip()
+        if not text:
+            return abort(409, {"q": ["Missing data for required field."]})
+        if len(text) > self.max_query_length:
+            return abort(409, {"q": ["Longer than maximum length {}.".format(self.max_query_length)]})
+        return text
+
+    def get(self, obj_id=None):
+        """
+
+        :param obj_id:
+        :type obj_id:
+        :return:
+        :rtype:
+        """
+        text = self.search_query()
+        limit = self.get_limit()
+        offset = 0
+        cursor = request.args.get("cursor")
+        if cursor:
+            try:
+                offset, _ = utils.decode_cursor(cursor, field="score", parse=int)
+            except ValueError:
+                return abort(409, {"cursor": ["Invalid cursor."]})
+        snippets = request.args.get("snippets", "true").lower() != "false"
+        limit = max(0, min(limit, self.max_results - offset))
+
+        # the list's own scoping, user_id and deleted: False, which the text index is prefixed with
+        params = self.limit_query(self.query()).raw_query
+        fields = [self.model_field(name).mongo_name for name in ("name", "subject", "body")] if snippets \
+            else self.raw_reader.projection
+        docs = self.service_klass.search(params, text, skip=offset, limit=limit + 1, fields=fields) if limit else []
+        page = [self.raw_reader.to_record(doc) for doc in docs[:limit]]
+        next_cursor = None
+        if len(docs) > limit:
+            next_cursor = utils.encode_cursor(offset + limit, page[-1]["pk"], field="score")
+
+        with timed("serialization"):
+            if not snippets:
+                return {"data": self.response_serializer.dump(page, many=True), "next_cursor": next_cursor}
+            terms = utils.search_terms(text)
+            for record in page:
+                record["snippet"] = utils.snippet(record.pop("body", None), terms, width=self.snippet_width)
+            return {"data": self.snippet_serializer.dump(page, many=True), "next_cursor": next_cursor}
+
+    def post(self):
+        abort(400)
+
+    def put(self, obj_id=None):
+        abort(400)
+
+    def delete(self, obj_id=None):
+        abort(400)
+
+    @classmethod
+    def initiate(cls, serializers=None, service_klass=None):
+        cls = super(TemplateSearchResource, cls).initiate(serializers=serializers, service_klass=service_klass)
+        cls.snippet_serializer = compile_schema(serializers["snippet"])
+        return cls
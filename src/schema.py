@@ -1,4 +1,4 @@
-from marshmallow import Schema, EXCLUDE, fields as _fields, validates, ValidationError
+from marshmallow import Schema, EXCLUDE, fields as _fields, validates, post_load, ValidationError
 
 from src.models import User
 
@@ -21,14 +21,26 @@ class RegistrationSchema(UserResponseSchema):
 
 
 class LoginSchema(ExcludeSchema):
+    # everything the login flow reads off the user, so validation and verification share one projected lookup
+    user_fields = ("first_name", "last_name", "email", "password", "date_created")
+
     password = _fields.String(required=True, allow_none=False)
     email = _fields.String(required=True, allow_none=False)
 
     @validates("email")
     def validate_email(self, email):
-        if not User.objects.raw({"email": email}).count():
+        try:
+            self.context["user"] = User.objects.raw({"email": email}).only(*self.user_fields).first()
+        except User.DoesNotExist:
             raise ValidationError(message="Invalid email", field_name="email")
 
+    @post_load
+    def attach_user(self, data, **kwargs):
+        """hand the user found during validation to the resource"""
+        if "user" in self.context:
+            data["user"] = self.context["user"]
+        return data
+
 
 class LoginResponseSchema(UserResponseSchema):
     auth_token = _fields.String(required=True, allow_none=False)
@@ -45,7 +57,31 @@ class TemplateSchema(ExcludeSchema):
 
 
 class TemplateResponseSchema(TemplateSchema):
+    # stored as the model's name field
+    template_name = _fields.String(attribute="name")
     pk = _fields.String(required=False, allow_none=True)
     user_id = _fields.String(required=False, allow_none=True)
     date_created = _fields.DateTime(required=True, allow_none=False)
     last_updated = _fields.DateTime(required=True, allow_none=False)
+
+
+class TemplateSearchResultSchema(TemplateResponseSchema):
+    score = _fields.Float(required=False, allow_none=True)
+
+
+class TemplateSnippetSchema(ExcludeSchema):
+    pk = _fields.String(required=False, allow_none=True)
+    template_name = _fields.String(attribute="name")
+    subject = _fields.String(required=False, allow_none=True)
+    snippet = _fields.String(required=False, allow_none=True)
+    score = _fields.Float(required=False, allow_none=True)
+
+
+class RenderSchema(ExcludeSchema):
+    context = _fields.Dict(keys=_fields.String(), required=False, load_default=dict)
+
+
+class RenderResponseSchema(ExcludeSchema):
+    pk = _fields.String(required=False, allow_none=True)
+    subject = _fields.String(required=True, allow_none=False)
+    body = _fields.String(required=True, allow_none=False)
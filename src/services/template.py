@@ -1,11 +1,76 @@
+import settings
+
+from ..base.cache import ObjectCache
+from ..base.merge import MailMerge
+from ..base.rendering import TemplateRenderer
 from ..base.service import ServiceFactory
 from ..models import Template
 
 
-BaseTemplateService = ServiceFactory.create_service(Template)
+template_cache = ObjectCache(maxsize=settings.OBJECT_CACHE_SIZE, ttl=settings.OBJECT_CACHE_TTL) \
+    if settings.OBJECT_CACHE_TTL > 0 else None
+
+renderer = TemplateRenderer(maxsize=settings.RENDER_CACHE_SIZE, ttl=settings.RENDER_CACHE_TTL,
+                            autoescape=settings.RENDER_AUTOESCAPE, **settings.RENDER_LIMITS)
+mail_merge = MailMerge(executor=settings.MERGE_EXECUTOR, workers=settings.MERGE_WORKERS,
+                       batch_size=settings.MERGE_BATCH_SIZE, max_in_flight=settings.MERGE_MAX_IN_FLIGHT,
+                       autoescape=settings.RENDER_AUTOESCAPE, limits=settings.RENDER_LIMITS,
+                       chunk_timeout=settings.MERGE_CHUNK_TIMEOUT)
+
+BaseTemplateService = ServiceFactory.create_service(Template, cache=template_cache)
 
 
 class TemplateService(BaseTemplateService):
     """
 
     """
+
+    @classmethod
+    def render(cls, obj, context=None):
+        """
+        Render the subject and body of a template
+
+        :param obj: the template, a model instance or a raw record
+        :param context: the variables the template is rendered with (dict)
+        :return: {"subject": ..., "body": ...}
+        :raises: RenderError when the template doesn't compile or render
+        """
+
+        return renderer.render(obj, context)
+
+    @classmethod
+    def render_batch(cls, obj, lines, batch_size=None):
+        """
+        Render a template once per recipient context (mail merge)
+
+        :param obj: the template, a model instance or a raw record
+        :param lines: NDJSON recipient contexts, one object per line (any iterable of lines)
+        :param batch_size: rows rendered per chunk
+        :return: generator of NDJSON blocks, {"row", "subject", "body"} or {"row", "error"} per line, in order
+        :raises: RenderError when the template doesn't compile
+        """
+
+        return mail_merge.render(obj, lines, batch_size=batch_size)
+
+    @classmethod
+    def search(cls, params, text, skip=0, limit=50, fields=None):
+        """
+        Full-text search through the text index, best matches first
+
+        :param params: the filter the search is scoped by, it has to cover the index's equality prefix
+        :param text: the $text search string
+        :param skip: matches to skip
+        :param limit: matches to return at most
+        :param fields: mongo field names to return, all of them by default
+        :return: list of raw documents, each with its text score as "score"
+        """
+
+        score = {"$meta": "textScore"}
+        projection = {"$project": dict([(field, 1) for field in fields], score=score)} if fields \
+            else {"$addFields": {"score": score}}
+        query = dict(params, **{"$text": {"$search": text}})
+        pipeline = [{"$sort": {"score": score, "_id": -1}}]
+        if skip:
+            pipeline.append({"$skip": skip})
+        pipeline += [{"$limit": limit}, projection]
+        return list(cls.model_class.objects.raw(query).aggregate(*pipeline))
@@ -1,6 +1,5 @@
 from ..base.service import ServiceFactory
 from ..models import User
-from pprint import pprint
 
 
 BaseUserService = ServiceFactory.create_service(User)
@@ -14,6 +13,8 @@ class UserService(BaseUserService):
     @classmethod
     def register_account(cls, **kwargs):
         """
+        Hash the password first so the account is inserted with a single write.
+        Duplicate emails are rejected by the unique email index with a DuplicateKeyError.
 
         :param kwargs:
         :type kwargs:
@@ -21,7 +22,6 @@ class UserService(BaseUserService):
         :rtype:
         """
 
-        pprint(kwargs)
         password = kwargs.pop("password")
-        user = cls.create(**kwargs)
-        return user.set_password(password)
+        kwargs["password"] = cls.model_class.make_password(password)
+        return cls.create(**kwargs)
@@ -0,0 +1,76 @@
+"""
+The bounds of the template sandbox: a stored template can't build huge values, loop or run without limit.
+"""
+
+from datetime import datetime
+
+import pytest
+
+from src.base.rendering import RenderError, TemplateRenderer
+
+LIMITS = {"max_output": 64 * 1024, "max_iterations": 10000, "timeout": 1.0}
+
+HOSTILE = {
+    "repeat": "{{ 'x' * 10 ** 7 }}",
+    "repeat-left": "{{ 10 ** 7 * 'x' }}",
+    "repeat-list": "{{ [1] * 10 ** 7 }}",
+    # jinja's ** is left associative, 10 ** 10 ** 8 is only (10 ** 10) ** 8
+    "power": "{{ 10 ** (10 ** 8) }}",
+    "multiply": "{% set n = 2 ** 100000 %}{{ n * n * n * n * n * n > 0 }}",
+    "nested-loops": "{% for i in range(3000) %}{% for j in range(3000) %}{% endfor %}{% endfor %}",
+    "output": "{% for i in range(5000) %}{{ 'x' * 100 }}{% endfor %}",
+    "center-filter": "{{ 'x' | center(10 ** 8) }}",
+    "center-method": "{{ 'x'.center(10 ** 8) }}",
+    "format-width": "{{ '%100000000s' | format('x') }}",
+    "format-method": "{{ '{:>100000000}'.format('x') }}",
+    "replace": "{{ ('x' * 60000).replace('', 'y' * 60000) }}",
+    "concat-doubling": "{% set ns = namespace(s='x' * 1000) %}{% for i in range(30) %}{% set ns.s = ns.s ~ ns.s %}"
+                       "{% endfor %}{{ ns.s | length }}",
+    "plus-doubling": "{% set ns = namespace(s='x' * 1000) %}{% for i in range(30) %}{% set ns.s = ns.s + ns.s %}"
+                     "{% endfor %}{{ ns.s | length }}",
+    "extend-doubling": "{% set l = [1] %}{% for i in range(30) %}{{ l.extend(l) }}{% endfor %}",
+}
+
+
+def render(body, context=None, **limits):
+    renderer = TemplateRenderer(fields=("body",), **dict(LIMITS, **limits))
+    obj = {"pk": body, "last_updated": datetime(2019, 1, 2), "body": body}
+    return renderer.render(obj, context or {})["body"]
+
+
+@pytest.mark.parametrize("body", list(HOSTILE.values()), ids=list(HOSTILE))
+def test_hostile_templates_fail(body):
+    with pytest.raises(RenderError):
+        render(body)
+
+
+def test_timeout():
+    body = "{% for i in range(100000) %}{{ items | sort | join(',') }}{% endfor %}"
+    with pytest.raises(RenderError, match="longer than"):
+        render(body, {"items": list(range(1000))}, max_iterations=10 ** 6, max_output=10 ** 9, timeout=0.05)
+
+
+def test_iterations_are_counted_per_render():
+    body = "{% for i in range(6000) %}{% endfor %}ok"
+    renderer = TemplateRenderer(fields=("body",), **LIMITS)
+    obj = {"pk": "loop", "last_updated": datetime(2019, 1, 2), "body": body}
+    for _ in range(3):
+        assert renderer.render(obj, {}) == {"body": "ok"}
+
+
+@pytest.mark.parametrize("body, expected", [
+    ("{{ 2 ** 200 }}", str(2 ** 200)),
+    ("{{ 'ab' * 3 }}~{{ 3 * 'ab' }}", "ababab~ababab"),
+    ("{{ 6 * 7 }} {{ 7 % 4 }} {{ 1 + 2 }} {{ 'a' + 'b' }} {{ 'a' ~ 1 }}", "42 3 3 ab a1"),
+    ("{{ '%5.2f' | format(3.14159) }}|{{ '{:>4}'.format('x') }}|{{ 'x' | center(5) }}", " 3.14|   x|  x  "),
+    ("{{ 'a-b'.replace('-', '+') }} {{ 'a-b' | replace('-', '+') }}", "a+b a+b"),
+    ("{% for i in range(3) %}{% for j in range(3) %}{{ i * j }}{% endfor %}{% endfor %}", "000012024"),
+])
+def test_ordinary_templates_render(body, expected):
+    assert render(body) == expected
+
+
+def test_context_values_are_bounded_too():
+    with pytest.raises(RenderError):
+        render("{{ name * count }}", {"name": "x", "count": 10 ** 7})
+    assert render("Hi {{ name }}", {"name": "Ada"}) == "Hi Ada"
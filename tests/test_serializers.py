@@ -0,0 +1,154 @@
+"""
+Parity of compile_schema with marshmallow: a compiled serializer must dump exactly what schema().dump() does.
+"""
+
+from datetime import datetime
+import inspect
+
+import pytest
+from bson.objectid import ObjectId
+from marshmallow import Schema, fields as _fields, post_dump
+
+from src import schema as app_schemas
+from src.base.serializers import CompiledSerializer, compile_schema
+from src.models import Template, User
+
+SCHEMAS = [klass for name, klass in sorted(inspect.getmembers(app_schemas, inspect.isclass))
+           if issubclass(klass, Schema) and klass.__module__ == app_schemas.__name__]
+
+NOW = datetime(2019, 1, 2, 15, 42, 7, 123000)
+
+SAMPLE_VALUES = {
+    _fields.String: "text",
+    _fields.Integer: 3,
+    _fields.Float: 1.5,
+    _fields.Boolean: True,
+    _fields.DateTime: NOW,
+    _fields.Dict: {"name": "Ada", "items": [1, 2]},
+}
+
+
+def sample_record(schema_class):
+    """ a dict holding a value for every attribute the schema reads """
+    record = {}
+    for name, field in schema_class().dump_fields.items():
+        record[field.attribute or name] = SAMPLE_VALUES.get(type(field), "value")
+    record["pk"] = ObjectId()
+    return record
+
+
+def assert_parity(schema_class, obj, **kwargs):
+    expected = schema_class(**kwargs).dump(obj)
+    assert compile_schema(schema_class, **kwargs).dump(obj) == expected
+    many = [obj, obj]
+    assert compile_schema(schema_class, **kwargs).dump(many, many=True) == schema_class(**kwargs).dump(many, many=True)
+
+
+def make_user():
+    user = User(first_name="Ada", last_name="Lovelace", email="ada@example.com", password="hash",
+                date_created=NOW, last_updated=NOW)
+    user.pk = ObjectId()
+    return user
+
+
+def make_template():
+    template = Template(name="welcome", body="Hi {{ name }}", subject="Hello", user_id="u1", deleted=False,
+                        date_created=NOW, last_updated=NOW)
+    template.pk = ObjectId()
+    return template
+
+
+def test_every_schema_is_covered():
+    assert app_schemas.TemplateResponseSchema in SCHEMAS
+    assert app_schemas.RenderSchema in SCHEMAS
+
+
+@pytest.mark.parametrize("schema_class", SCHEMAS, ids=lambda klass: klass.__name__)
+def test_model_instances(schema_class):
+    assert_parity(schema_class, make_user())
+    assert_parity(schema_class, make_template())
+
+
+@pytest.mark.parametrize("schema_class", SCHEMAS, ids=lambda klass: klass.__name__)
+def test_dicts(schema_class):
+    assert_parity(schema_class, sample_record(schema_class))
+
+
+@pytest.mark.parametrize("schema_class", SCHEMAS, ids=lambda klass: klass.__name__)
+def test_missing_keys_and_none_values(schema_class):
+    record = sample_record(schema_class)
+    assert_parity(schema_class, {})
+    assert_parity(schema_class, dict(list(record.items())[::2]))
+    assert_parity(schema_class, dict((key, None) for key in record))
+
+
+@pytest.mark.parametrize("schema_class", SCHEMAS, ids=lambda klass: klass.__name__)
+def test_only(schema_class):
+    names = sorted(schema_class().dump_fields)[:2]
+    if names:
+        assert_parity(schema_class, sample_record(schema_class), only=names)
+
+
+def test_attribute_is_read_and_dumped_under_the_field_name():
+    dumped = compile_schema(app_schemas.TemplateResponseSchema).dump(make_template())
+    assert dumped["template_name"] == "welcome"
+    assert "name" not in dumped
+
+
+class KeyedSchema(Schema):
+    """ field options the compiler handles inline, and ones it leaves to marshmallow """
+
+    title = _fields.String(data_key="heading")
+    owner = _fields.String(attribute="user_id", data_key="ownerId")
+    city = _fields.String(attribute="address.city")
+    count = _fields.Integer(dump_default=0)
+    ratio = _fields.Float(as_string=True)
+    day = _fields.DateTime(format="%Y-%m-%d")
+    stamp = _fields.DateTime(format="timestamp")
+    tags = _fields.List(_fields.String())
+    extra = _fields.Dict()
+    label = _fields.Method("make_label")
+    # a key that collides with a dict attribute turns off the dict.get shortcut
+    items = _fields.Raw()
+
+    def make_label(self, obj):
+        return "label"
+
+
+class Keyed(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+KEYED = {"title": "t", "user_id": "u1", "address": {"city": "Lagos"}, "ratio": 0.25, "day": NOW, "stamp": NOW,
+         "tags": ["a", 1], "extra": {"k": "v"}, "items": [1]}
+
+
+@pytest.mark.parametrize("obj", [KEYED, {}, dict((key, None) for key in KEYED), Keyed(**KEYED), Keyed()],
+                         ids=["dict", "empty", "none", "object", "empty-object"])
+def test_data_key_attribute_and_fallback_fields(obj):
+    assert isinstance(compile_schema(KeyedSchema), CompiledSerializer)
+    assert_parity(KeyedSchema, obj)
+
+
+def test_data_key_is_the_output_key():
+    dumped = compile_schema(KeyedSchema).dump(KEYED)
+    assert dumped["heading"] == "t"
+    assert dumped["ownerId"] == "u1"
+    assert "title" not in dumped and "owner" not in dumped
+
+
+class HookedSchema(Schema):
+    name = _fields.String()
+
+    @post_dump
+    def shout(self, data, **kwargs):
+        data["name"] = data["name"].upper()
+        return data
+
+
+def test_schemas_with_dump_hooks_are_not_compiled():
+    serializer = compile_schema(HookedSchema)
+    assert not isinstance(serializer, CompiledSerializer)
+    assert_parity(HookedSchema, {"name": "ada"})